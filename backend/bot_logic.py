@@ -1,13 +1,18 @@
 import asyncio
+import logging
 import re
-import hashlib
-import json
-from typing import Optional, Dict
+import time
+import xxhash
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Optional, Dict, Tuple
 from rag_engine import RAGEngine
 from context_manager import ContextManager
 from llm_provider import llm_provider
 from tools import book_ticket, cancel_ticket, get_my_tickets
 
+logger = logging.getLogger("bot")
+
 # Shorter system prompt (<100 tokens)
 SYSTEM_PROMPT = """You're Burraa's voice assistant for event booking. Be conversational, concise (1-2 sentences), and natural.
 
@@ -19,6 +24,178 @@ Guidelines:
 
 You'll get context, search results, and the user's message."""
 
+# Shared system message; LLM providers only read the messages they're given
+_SYS_MSG = {"role": "system", "content": SYSTEM_PROMPT}
+
+# Intent keyword flags. One scan per message records every keyword/ID hit with
+# its offsets; intents are resolved from those hits without re-scanning.
+_CANCEL = 1
+_BOOK = 2
+_MY = 4
+_TICKET = 8
+_SIMILAR = 16
+_DETAILS = 32
+_REF = 64
+_ID_TIC = 128
+_ID_EVT = 256
+# Set once the hits confirm a context-dependent intent
+_HIT_BOOK_REF = 512
+_HIT_MY_TICKETS = 1024
+_HIT_DETAILS_REF = 2048
+
+_KEYWORD_FLAGS = {
+    "cancel": _CANCEL, "delete": _CANCEL, "remove": _CANCEL,
+    "book": _BOOK, "buy": _BOOK, "purchase": _BOOK, "reserve": _BOOK,
+    "get": _BOOK | _MY,
+    "my": _MY, "show": _MY, "view": _MY, "list": _MY,
+    "ticket": _TICKET, "booking": _BOOK | _TICKET,
+    "similar": _SIMILAR, "like": _SIMILAR, "related": _SIMILAR,
+    "price": _DETAILS, "cost": _DETAILS, "how much": _DETAILS,
+    "details": _DETAILS, "info": _DETAILS, "tell me about": _DETAILS,
+    "that": _REF, "it": _REF, "this": _REF, "first": _REF, "second": _REF,
+}
+_GROUP_FLAGS = {"noun": _TICKET, "tic": _ID_TIC, "evt": _ID_EVT}
+_BOOK_VERBS = frozenset({"book", "buy", "purchase", "reserve", "get"})
+_BOOK_REF_WORDS = frozenset({"that", "it", "this"})
+
+# Keywords start at a word boundary; the ticket nouns and IDs may also appear
+# mid-word ("rebooking", "#tic_123"). The scan is a zero-width lookahead so
+# hits may overlap, as the separate searches they replace did: the keyword in
+# "getic_5" must not swallow the start of "tic_5".
+_RE_KEYWORDS = re.compile(
+    r'(?=(?P<kw>\b(?:' + '|'.join(sorted(map(re.escape, _KEYWORD_FLAGS), key=len, reverse=True)) + r'))'
+    r'|(?P<noun>ticket|booking)'
+    r'|(?P<tic>tic_\w+)'
+    r'|(?P<evt>evt\d+))'
+)
+_RE_QTY = re.compile(r'\b(\d+)\s*(?:ticket|seat|spot)')
+_RE_REF_WORDS = re.compile(r'\b(that|it|this|first|second)\b')
+
+
+def _ends_word(text: str, end: int) -> bool:
+    """True if a word boundary follows text[:end]."""
+    return end == len(text) or not (text[end].isalnum() or text[end] == '_')
+
+
+def _first_after(hits: list, lead_bit: int, target_bit: int) -> Optional[str]:
+    """Text of the first target hit after the first lead hit (a lazy `lead.*?target`)."""
+    lead_end = None
+    for start, end, word, bits in hits:
+        if lead_end is None:
+            if bits & lead_bit:
+                lead_end = end
+        elif bits & target_bit and start >= lead_end:
+            return word
+    return None
+
+
+@lru_cache(maxsize=512)
+def _extract_intent_static(msg_lower: str) -> Tuple[int, Optional[Dict], int]:
+    """Run all pattern work for a lowercased message (no context dependency).
+    
+    Returns (flags, intent, quantity); intent is set when the message resolves
+    without conversation context, otherwise the _HIT_* flags tell the caller
+    which reference-based intents matched.
+    """
+    flags = 0
+    hits = []
+    for m in _RE_KEYWORDS.finditer(msg_lower):
+        group = m.lastgroup
+        word = m.group(group)
+        bits = _KEYWORD_FLAGS[word] if group == "kw" else _GROUP_FLAGS[group]
+        flags |= bits
+        hits.append((m.start(group), m.end(group), word, bits))
+    
+    # Cancel intent
+    if flags & _CANCEL and flags & _ID_TIC:
+        booking_id = _first_after(hits, _CANCEL, _ID_TIC)
+        if booking_id:
+            return flags, {"type": "cancel", "booking_id": booking_id}, 1
+    
+    quantity_match = _RE_QTY.search(msg_lower) if flags & _BOOK else None
+    quantity = int(quantity_match.group(1)) if quantity_match else 1
+    
+    # Book intent with explicit event ID
+    if flags & _BOOK and flags & _ID_EVT:
+        event_id = _first_after(hits, _BOOK, _ID_EVT)
+        if event_id:
+            return flags, {"type": "book", "event_id": event_id, "quantity": quantity}, quantity
+    
+    # Booking verb directly followed by "that"/"it"/"this"
+    if flags & _BOOK and flags & _REF:
+        for (_, end, word, _), (start, _, next_word, _) in zip(hits, hits[1:]):
+            if word in _BOOK_VERBS and next_word in _BOOK_REF_WORDS and msg_lower[end:start].isspace():
+                flags |= _HIT_BOOK_REF
+                break
+    
+    if flags & _MY and flags & _TICKET and _first_after(hits, _MY, _TICKET):
+        # Booking by reference takes precedence when it resolves
+        if not flags & _HIT_BOOK_REF:
+            return flags, {"type": "my_tickets"}, quantity
+        flags |= _HIT_MY_TICKETS
+    
+    # Details keyword as a whole word; the reference word only needs to start
+    # one ("its price", "item info")
+    if flags & _DETAILS and flags & _REF:
+        if any(bits & _DETAILS and _ends_word(msg_lower, end) for _, end, _, bits in hits):
+            flags |= _HIT_DETAILS_REF
+    
+    return flags, None, quantity
+
+
+# Phone validation: ten ASCII digits checked as ten byte lanes of one integer
+_PHONE_LEN = 10
+_LANES = int.from_bytes(b'\x01' * _PHONE_LEN, 'little')
+
+
+def _is_phone_number(text: str) -> bool:
+    """True for exactly ten ASCII digits.
+    
+    For ASCII bytes, (x - 0x30) & ~x sets a lane's high bit when the byte is
+    below '0', and x + 0x46 does when it is above '9'; one mask tests all lanes.
+    """
+    if len(text) != _PHONE_LEN or not text.isascii():
+        return False
+    x = int.from_bytes(text.encode('ascii'), 'little')
+    return not ((((x - 0x30 * _LANES) & ~x) | (x + 0x46 * _LANES)) & (0x80 * _LANES))
+
+
+@lru_cache(maxsize=256)
+def _format_results_cached(events: Tuple[Tuple[str, str, str], ...]) -> str:
+    """Format (name, date, location) rows; the same top hits repeat across turns."""
+    return "Found: " + " Also, ".join(
+        f"{name} on {date} at {location}. " for name, date, location in events
+    )
+
+# Semantic LLM response cache (Redis Stack vector index)
+SEMANTIC_INDEX = "sem:llm"
+SEMANTIC_PREFIX = "sem:llm:"
+SEMANTIC_MIN_SIMILARITY = 0.92
+_semantic_index_ready = None  # None = not checked yet, False = Redis Stack unavailable
+# Transient index-setup failures (connection drops, timeouts) are retried after this
+SEMANTIC_INDEX_RETRY_SECONDS = 30
+_semantic_index_retry_at = 0.0
+
+
+@lru_cache(maxsize=None)
+def _redisearch() -> SimpleNamespace:
+    """RediSearch client classes, imported on first semantic-cache use.
+    
+    redis-py 6 renamed indexDefinition to index_definition.
+    """
+    from redis.commands.search.field import TagField, TextField, VectorField
+    from redis.commands.search.query import Query
+    try:
+        from redis.commands.search.index_definition import IndexDefinition, IndexType
+    except ImportError:
+        from redis.commands.search.indexDefinition import IndexDefinition, IndexType
+    return SimpleNamespace(TagField=TagField, TextField=TextField, VectorField=VectorField,
+                           Query=Query, IndexDefinition=IndexDefinition, IndexType=IndexType)
+
+# Streaming: flush buffered LLM tokens at this size or age
+STREAM_FLUSH_CHARS = 40
+STREAM_FLUSH_INTERVAL = 0.025  # seconds
+
 # Conversation States
 STATE_AWAITING_PHONE = "AWAITING_PHONE"
 STATE_CONVERSING = "CONVERSING"
@@ -31,6 +208,9 @@ TEMPLATES = {
     "no_results": "No events found. Try 'concerts', 'food trails', or 'adventure'."
 }
 
+# Searches run at connection start so the first real query hits warm paths
+WARMUP_QUERIES = ("concerts", "food trails", "adventure")
+
 class ConversationManager:
     """Manages intelligent conversation with caching and optimization."""
     
@@ -43,36 +223,55 @@ class ConversationManager:
         self.context_manager = None
         self.cache_hits = 0
         self.cache_misses = 0
+        self._bg: set = set()  # in-flight background Redis writes
+        self._pending_save: Optional[asyncio.Task] = None
+        self._load_task: Optional[asyncio.Task] = None  # context load started with the greeting
+        self._tickets_stale = False  # cached bookings list to drop in the next save
         
     async def initialize(self):
         try:
-            # Verify Redis (optional now)
-            redis_available = False
-            if self.redis_client:
-                try:
-                    redis_available = await self.redis_client.ping()
-                except Exception as e:
-                    print(f"⚠️ Redis unavailable: {e}. Running without caching.")
-            
-            # Initialize LLM provider
+            # Initialize LLM provider. Redis was already pinged at server startup
+            # (redis_client is None if it was down), so no extra round trip here.
             await llm_provider.initialize()
             
-            mode = "with caching" if redis_available else "stateless mode"
-            print(f"✅ Connected to LLM ({mode})")
+            mode = "with caching" if self.redis_client else "stateless mode"
+            logger.info("Connected to LLM (%s)", mode)
             await self.send_reply("Hello! I'm your event assistant. Could you share your 10-digit phone number?")
+            
+            # Warm the embedder/index (and search cache) while the user types
+            self._spawn(self._warmup())
         
         except Exception as e:
-            print(f"❌ Initialization error: {e}")
+            logger.error("Initialization error: %s", e)
             await self.send_reply("Something went wrong. Please try again!")
             if self.transport:
                 await self.transport.close()
     
+    async def _warmup(self):
+        """Best-effort RAG searches for the queries suggested to users."""
+        for query in WARMUP_QUERIES:
+            try:
+                await self.rag.search(query, top_k=5)
+            except Exception:
+                pass
+    
+    def _spawn(self, coro):
+        """Run a coroutine off the reply path, keeping a reference until it finishes."""
+        task = asyncio.create_task(coro)
+        self._bg.add(task)
+        task.add_done_callback(self._bg.discard)
+        return task
+    
     async def cleanup(self):
         """Clean up resources."""
-        await llm_provider.cleanup()
+        if self._bg:
+            await asyncio.gather(*self._bg, return_exceptions=True)
+        # A save that failed or was superseded leaves the context dirty; persist it once more
+        if self.context_manager and (self.context_manager.dirty or self._tickets_stale):
+            await self._save_context()
         if self.cache_hits + self.cache_misses > 0:
             hit_rate = self.cache_hits / (self.cache_hits + self.cache_misses) * 100
-            print(f"📊 Cache hit rate: {hit_rate:.1f}% ({self.cache_hits}/{self.cache_hits + self.cache_misses})")
+            logger.info("Cache hit rate: %.1f%% (%d/%d)", hit_rate, self.cache_hits, self.cache_hits + self.cache_misses)
     
     async def send_reply(self, message: str):
         """Send complete message to client."""
@@ -82,6 +281,10 @@ class ConversationManager:
     
     async def send_chunk(self, chunk: str):
         """Send streaming chunk to client."""
+        self._send_chunk_now(chunk)
+    
+    def _send_chunk_now(self, chunk: str):
+        """Send a streaming chunk synchronously (usable from loop timer callbacks)."""
         if not self.transport or self.transport.readyState != "open":
             return
         self.transport.send(f"[CHUNK]{chunk}")
@@ -94,48 +297,46 @@ class ConversationManager:
     
     def _clean_message(self, message: str) -> str:
         """Clean up message."""
-        return re.sub(r'\s+', ' ', message.strip())
+        return ' '.join(message.split())
     
     def extract_intent(self, message: str) -> Dict:
-        """Extract user intent using patterns."""
-        msg_lower = message.lower()
-        
-        # Cancel intent
-        cancel_match = re.search(r'\b(cancel|delete|remove).*?(tic_\w+)', msg_lower)
-        if cancel_match:
-            return {"type": "cancel", "booking_id": cancel_match.group(2)}
+        """Extract user intent using patterns.
         
-        # Book intent with explicit event ID
-        book_match = re.search(r'\b(book|buy|purchase|reserve|get).*?(evt\d+)', msg_lower)
-        if book_match:
-            quantity_match = re.search(r'\b(\d+)\s*(?:ticket|seat|spot)', msg_lower)
-            quantity = int(quantity_match.group(1)) if quantity_match else 1
-            return {"type": "book", "event_id": book_match.group(2), "quantity": quantity}
+        The lowercased message rides along as intent["_msg_lower"] so later
+        steps of the turn don't lowercase it again.
+        """
+        msg_lower = message.lower()
+        intent = self._match_intent(message, msg_lower)
+        intent["_msg_lower"] = msg_lower
+        return intent
+    
+    def _match_intent(self, message: str, msg_lower: str) -> Dict:
+        """Resolve the intent, consulting context only for reference-based intents."""
+        flags, intent, quantity = _extract_intent_static(msg_lower)
+        if intent:
+            return dict(intent)
         
         # Book intent with reference
-        if re.search(r'\b(book|buy|purchase|reserve|get)\s+(that|it|this)', msg_lower):
-            resolved_id = self.context_manager.resolve_reference(message) if self.context_manager else None
+        if flags & _HIT_BOOK_REF:
+            resolved_id = self.context_manager.resolve_reference(message, msg_lower) if self.context_manager else None
             if resolved_id:
-                quantity_match = re.search(r'\b(\d+)\s*(?:ticket|seat|spot)', msg_lower)
-                quantity = int(quantity_match.group(1)) if quantity_match else 1
                 return {"type": "book", "event_id": resolved_id, "quantity": quantity}
         
         # My tickets intent
-        if re.search(r'\b(my|show|view|list|get).*?(ticket|booking)', msg_lower):
+        if flags & _HIT_MY_TICKETS:
             return {"type": "my_tickets"}
         
         # Similar events intent
-        if re.search(r'\b(similar|like|related)', msg_lower):
-            resolved_id = self.context_manager.resolve_reference(message) if self.context_manager else None
+        if flags & _SIMILAR:
+            resolved_id = self.context_manager.resolve_reference(message, msg_lower) if self.context_manager else None
             if resolved_id:
                 return {"type": "similar", "event_id": resolved_id}
         
         # Details query
-        if re.search(r'\b(price|cost|how much|details|info|tell me about)\b', msg_lower):
-            if re.search(r'\b(that|it|this|first|second)', msg_lower):
-                resolved_id = self.context_manager.resolve_reference(message) if self.context_manager else None
-                if resolved_id:
-                    return {"type": "details", "event_id": resolved_id}
+        if flags & _HIT_DETAILS_REF:
+            resolved_id = self.context_manager.resolve_reference(message, msg_lower) if self.context_manager else None
+            if resolved_id:
+                return {"type": "details", "event_id": resolved_id}
         
         return {"type": "search", "query": message}
     
@@ -148,49 +349,92 @@ class ConversationManager:
         if not results:
             return TEMPLATES["no_results"]
         
-        formatted = "Found: "
-        for i, event in enumerate(results[:2]):
-            if i > 0:
-                formatted += " Also, "
-            formatted += f"{event['name']} on {event.get('date/days', 'TBA')} at {event.get('location', 'TBA')}. "
-        return formatted
+        return _format_results_cached(tuple(
+            (event['name'], event.get('date/days', 'TBA'), event.get('location', 'TBA'))
+            for event in results[:2]
+        ))
     
     async def handle_message(self, message: str):
         """Handle incoming messages with optimization."""
-        message = self._clean_message(message)
-        
-        # Phone number collection
+        # Phone number collection (digits only, so a plain strip is enough)
         if self.state == STATE_AWAITING_PHONE:
-            if message.isdigit() and len(message) == 10:
+            message = message.strip()
+            if _is_phone_number(message):
                 self.phone_number = message
                 self.state = STATE_CONVERSING
                 
+                # The context is one key, so load is a single GET; the greeting
+                # doesn't depend on it and goes out while it is in flight
                 if self.redis_client:
                     self.context_manager = ContextManager(self.redis_client, self.phone_number)
-                    await self.context_manager.load()
+                    self._load_task = asyncio.create_task(self.context_manager.load())
                 
                 await self.send_reply(TEMPLATES["greeting"])
+                await self._await_context_load()
             else:
                 await self.send_reply(TEMPLATES["invalid_phone"])
             return
         
+        # Each message runs as its own task; a turn that arrives while the
+        # context is loading would otherwise be overwritten by the load
+        await self._await_context_load()
+        message = self._clean_message(message)
+        
         # Add to context
         if self.context_manager:
             self.context_manager.add_message("user", message)
-            await self.context_manager.save()
         
         # Extract intent
         intent = self.extract_intent(message)
         
+        try:
+            await self._dispatch_intent(intent, message)
+        finally:
+            # One pipelined context write per turn, off the reply path. A save
+            # still in flight from the previous turn is superseded by this one.
+            if self.context_manager and (self.context_manager.dirty or self._tickets_stale):
+                if self._pending_save and not self._pending_save.done():
+                    self._pending_save.cancel()
+                self._pending_save = self._spawn(self._save_context())
+    
+    async def _await_context_load(self):
+        """Wait for the context load started at phone entry, if still running."""
+        if self._load_task:
+            await self._load_task
+            self._load_task = None
+    
+    async def _save_context(self):
+        """Persist the turn's Redis writes (context, cache invalidation) in one round trip."""
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                self.context_manager.save_pipeline(pipe)
+                drop_tickets = self._tickets_stale
+                if drop_tickets:
+                    pipe.delete(f"tickets:{self.phone_number}")
+                await pipe.execute()
+            if drop_tickets:
+                self._tickets_stale = False
+        except asyncio.CancelledError:
+            self.context_manager.mark_dirty()
+            raise
+        except Exception as e:
+            self.context_manager.mark_dirty()
+            logger.warning("Context save error: %s", e)
+    
+    async def _dispatch_intent(self, intent: Dict, message: str):
+        """Run the handler for an extracted intent."""
         # Handle intents with templates (no LLM)
         if intent["type"] == "cancel":
             result = await cancel_ticket(intent["booking_id"], self.phone_number)
+            if result["status"] == "success":
+                self._invalidate_tickets_cache()
             await self.send_reply(f"{'Done! ' + result['message'] if result['status'] == 'success' else 'Hmm, ' + result['message']}")
             return
         
         elif intent["type"] == "book":
             result = await book_ticket(intent["event_id"], intent["quantity"], self.phone_number)
             if result["status"] == "success":
+                self._invalidate_tickets_cache()
                 booking = result["data"]
                 response = (f"Booked! 🎉 {booking['event_name']} on {booking['event_date']}. "
                            f"Total: ₹{booking['total_price']} for {booking['quantity']} ticket(s). "
@@ -198,21 +442,35 @@ class ConversationManager:
                 await self.send_reply(response)
                 if self.context_manager:
                     self.context_manager.clear_pending_booking()
-                    await self.context_manager.save()
             else:
                 await self.send_reply(result["message"])
             return
         
         elif intent["type"] == "my_tickets":
+            cache_key = f"tickets:{self.phone_number}"
+            if self.redis_client and not self._tickets_stale:
+                try:
+                    cached = await self.redis_client.get(cache_key)
+                    if cached:
+                        await self.send_reply(cached)
+                        return
+                except Exception as e:
+                    logger.warning("Cache read error: %s", e)
+            
             result = await get_my_tickets(self.phone_number)
             if result["status"] == "success":
                 bookings = result["data"]
                 response = "Your Bookings:\n" + "\n".join(
                     f"• {b['event_name']} - {b['event_date']} ({b['booking_id']})" for b in bookings
                 )
-                await self.send_reply(response)
+            elif result["status"] == "error":
+                response = result["message"]
             else:
-                await self.send_reply(TEMPLATES["no_bookings"])
+                response = TEMPLATES["no_bookings"]
+            await self.send_reply(response)
+            
+            if self.redis_client and result["status"] != "error":
+                self._spawn(self._cache_set(cache_key, response, ex=60))
             return
         
         # Intents requiring LLM (search, similar, details)
@@ -243,19 +501,27 @@ class ConversationManager:
         elif intent["type"] == "search":
             if self.context_manager:
                 self.context_manager.set_last_search(message)
-            results = await self.rag.search(message, top_k=5)
+            
+            # The semantic cache keys on the message alone, so look it up while RAG runs
+            search_task = asyncio.create_task(self.rag.search(message, top_k=5))
+            replied, embedding = await self._try_semantic_cache(message, intent)
+            if replied:
+                search_task.cancel()
+                return
+            
+            results = await search_task
+            event_ids = [e['id'] for e in results]
             if results:
                 if self.context_manager:
-                    self.context_manager.set_mentioned_events([e['id'] for e in results])
+                    self.context_manager.set_mentioned_events(event_ids)
                 tool_result = self.format_search_results(results)
             else:
                 tool_result = TEMPLATES["no_results"]
+            await self._generate_cached_response(message, tool_result, intent, embedding, event_ids)
+            return
         
         # Generate LLM response with caching
         await self._generate_cached_response(message, tool_result, intent)
-        
-        if self.context_manager:
-            await self.context_manager.save()
     
     def _response_cache_key(self, message: str, tool_result: Optional[str], intent: Dict) -> str:
         """Generate cache key for LLM response."""
@@ -264,32 +530,111 @@ class ConversationManager:
             context_str = str(self.context_manager.get_mentioned_events())
         
         hash_input = f"{intent['type']}:{message}:{tool_result}:{context_str}"
-        return f"llm:response:{hashlib.md5(hash_input.encode()).hexdigest()}"
+        return f"llm:response:{xxhash.xxh3_64_hexdigest(hash_input.encode('utf-8', 'ignore'))}"
     
-    async def _generate_cached_response(self, message: str, tool_result: Optional[str], intent: Dict):
-        """Generate LLM response with Redis caching."""
-        # Try cache
-        if self.redis_client:
-            try:
-                cache_key = self._response_cache_key(message, tool_result, intent)
-                cached = await self.redis_client.get(cache_key)
-                if cached:
-                    self.cache_hits += 1
-                    print(f"💾 LLM cache hit")
-                    await self.send_reply(cached)
-                    if self.context_manager:
-                        self.context_manager.add_message("assistant", cached)
-                    return
-            except Exception as e:
-                print(f"Cache read error: {e}")
+    async def _ensure_semantic_index(self) -> bool:
+        """Create the semantic cache vector index once per process."""
+        global _semantic_index_ready, _semantic_index_retry_at
+        if _semantic_index_ready is not None:
+            return _semantic_index_ready
+        if time.monotonic() < _semantic_index_retry_at:
+            return False
         
-        self.cache_misses += 1
+        try:
+            rs = _redisearch()
+        except ImportError as e:
+            logger.warning("Semantic cache disabled: %s", e)
+            _semantic_index_ready = False
+            return False
         
-        # Build messages (minimal context)
-        messages = [{"role": "system", "content": SYSTEM_PROMPT}]
+        schema = (
+            rs.TagField("intent_type"),
+            rs.TextField("response", no_stem=True),
+            rs.VectorField("embedding", "HNSW", {
+                "TYPE": "FLOAT32",
+                "DIM": self.rag.embedding_dim,
+                "DISTANCE_METRIC": "COSINE",
+            }),
+        )
+        definition = rs.IndexDefinition(prefix=[SEMANTIC_PREFIX], index_type=rs.IndexType.HASH)
+        try:
+            await self.redis_client.ft(SEMANTIC_INDEX).create_index(schema, definition=definition)
+            _semantic_index_ready = True
+        except Exception as e:
+            error = str(e).lower()
+            if "already exists" in error:
+                _semantic_index_ready = True
+            elif "unknown command" in error:
+                # No RediSearch module on this server; it won't appear mid-process
+                logger.warning("Semantic cache disabled: %s", e)
+                _semantic_index_ready = False
+            else:
+                logger.warning("Semantic index setup failed, retrying in %ds: %s", SEMANTIC_INDEX_RETRY_SECONDS, e)
+                _semantic_index_retry_at = time.monotonic() + SEMANTIC_INDEX_RETRY_SECONDS
+                return False
+        return _semantic_index_ready
+    
+    async def _semantic_lookup(self, embedding: bytes, intent: Dict):
+        """Find a cached (response, event_ids) for a semantically similar message."""
+        query = (
+            _redisearch().Query(f"(@intent_type:{{{intent['type']}}})=>[KNN 1 @embedding $vec AS distance]")
+            .sort_by("distance")
+            .return_fields("response", "event_ids", "distance")
+            .dialect(2)
+        )
+        result = await self.redis_client.ft(SEMANTIC_INDEX).search(query, query_params={"vec": embedding})
+        if result.docs and 1 - float(result.docs[0].distance) >= SEMANTIC_MIN_SIMILARITY:
+            doc = result.docs[0]
+            event_ids = getattr(doc, "event_ids", "")
+            return doc.response, event_ids.split(",") if event_ids else []
+        return None
+    
+    async def _semantic_store(self, message: str, embedding: bytes, event_ids: list, intent: Dict, response: str):
+        """Store a response in the semantic cache."""
+        key = f"{SEMANTIC_PREFIX}{xxhash.xxh3_64_hexdigest(message.encode('utf-8', 'ignore'))}"
+        # One MULTI so the indexed hash never exists without its TTL
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.hset(key, mapping={
+                "intent_type": intent["type"],
+                "response": response,
+                "event_ids": ",".join(event_ids),
+                "embedding": embedding,
+            })
+            pipe.expire(key, 300)  # 5min TTL
+            await pipe.execute()
+    
+    async def _cache_set(self, key: str, value: str, ex: int):
+        """Best-effort Redis SET with TTL."""
+        try:
+            await self.redis_client.set(key, value, ex=ex)
+        except Exception as e:
+            logger.warning("Cache write error: %s", e)
+    
+    def _invalidate_tickets_cache(self):
+        """Drop the cached bookings list after a booking change.
+        
+        The DEL rides in the end-of-turn save pipeline rather than costing its
+        own round trip before the reply.
+        """
+        if self.redis_client:
+            self._tickets_stale = True
+    
+    async def _store_response(self, cache_key: str, message: str, embedding: Optional[bytes],
+                              event_ids: list, intent: Dict, response: str):
+        """Write an LLM response to the exact-match and semantic caches."""
+        try:
+            await self.redis_client.set(cache_key, response, ex=300)  # 5min TTL
+            if embedding is not None:
+                await self._semantic_store(message, embedding, event_ids, intent, response)
+        except Exception as e:
+            logger.warning("Cache write error: %s", e)
+    
+    def _build_messages(self, message: str, tool_result: Optional[str], refers_back: bool) -> list:
+        """Build LLM messages (minimal context)."""
+        messages = [_SYS_MSG]
         
         # Only add context if user references something ("that", "it")
-        if self.context_manager and any(ref in message.lower() for ref in ['that', 'it', 'this', 'first', 'second']):
+        if self.context_manager and refers_back:
             context_summary = self.context_manager.build_context_summary()
             if context_summary != "No prior context":
                 messages.append({"role": "system", "content": f"Context: {context_summary}"})
@@ -300,29 +645,118 @@ class ConversationManager:
         
         # Add current message
         messages.append({"role": "user", "content": message})
+        return messages
+    
+    async def _try_semantic_cache(self, message: str, intent: Dict) -> Tuple[bool, Optional[bytes]]:
+        """Reply from the semantic cache if a similar search was answered recently.
+        
+        Returns (replied, embedding); on a miss the embedding is kept so the
+        fresh answer can be stored without embedding the message twice.
+        """
+        # Skip messages that lean on conversation context
+        if not self.redis_client or _RE_REF_WORDS.search(intent["_msg_lower"]):
+            return False, None
+        
+        try:
+            if not await self._ensure_semantic_index():
+                return False, None
+            embedding = (await self.rag.embed(message)).tobytes()
+            cached = await self._semantic_lookup(embedding, intent)
+        except Exception as e:
+            logger.warning("Semantic cache read error: %s", e)
+            return False, None
+        
+        if not cached:
+            return False, embedding
+        
+        response, event_ids = cached
+        self.cache_hits += 1
+        logger.debug("LLM semantic cache hit")
+        await self.send_reply(response)
+        if self.context_manager:
+            if event_ids:
+                self.context_manager.set_mentioned_events(event_ids)
+            self.context_manager.add_message("assistant", response)
+        return True, None
+    
+    async def _generate_cached_response(self, message: str, tool_result: Optional[str], intent: Dict,
+                                        embedding: Optional[bytes] = None, event_ids: list = ()):
+        """Generate LLM response with Redis caching."""
+        refers_back = bool(_RE_REF_WORDS.search(intent["_msg_lower"]))
+        
+        # Try cache; the GET is put on the wire before the prompt is assembled
+        cache_task = None
+        if self.redis_client:
+            cache_key = self._response_cache_key(message, tool_result, intent)
+            cache_task = asyncio.create_task(self.redis_client.get(cache_key))
+            await asyncio.sleep(0)
+        
+        messages = self._build_messages(message, tool_result, refers_back)
+        
+        if cache_task:
+            try:
+                cached = await cache_task
+                if cached:
+                    self.cache_hits += 1
+                    logger.debug("LLM cache hit")
+                    await self.send_reply(cached)
+                    if self.context_manager:
+                        self.context_manager.add_message("assistant", cached)
+                    return
+            except Exception as e:
+                logger.warning("Cache read error: %s", e)
+        
+        self.cache_misses += 1
+        
+        # Stream response, coalescing tokens into ~25ms / sentence-sized sends.
+        # A loop timer flushes a buffered partial sentence once it is
+        # STREAM_FLUSH_INTERVAL old, even if the next token is slow to come.
+        parts = []
+        loop = asyncio.get_running_loop()
+        buf = []
+        buf_len = 0
+        last_flush = loop.time()
+        timer = None
+        
+        def flush():
+            nonlocal buf_len, last_flush, timer
+            if timer is not None:
+                timer.cancel()
+                timer = None
+            if buf:
+                self._send_chunk_now(''.join(buf))
+                buf.clear()
+                buf_len = 0
+            last_flush = loop.time()
         
-        # Stream response
-        full_response = ""
         try:
             async for chunk in llm_provider.generate(messages, max_tokens=120):
-                full_response += chunk
-                await self.send_chunk(chunk)
+                parts.append(chunk)
+                buf.append(chunk)
+                buf_len += len(chunk)
+                if (buf_len >= STREAM_FLUSH_CHARS
+                        or loop.time() - last_flush > STREAM_FLUSH_INTERVAL
+                        or chunk.endswith(('.', '!', '?', '\n'))):
+                    flush()
+                elif timer is None:
+                    timer = loop.call_later(max(0.0, last_flush + STREAM_FLUSH_INTERVAL - loop.time()), flush)
             
+            flush()
             await self.send_done()
+            full_response = ''.join(parts)
             
             # Cache response
             if self.redis_client and full_response:
-                try:
-                    cache_key = self._response_cache_key(message, tool_result, intent)
-                    await self.redis_client.set(cache_key, full_response, ex=300)  # 5min TTL
-                except Exception as e:
-                    print(f"Cache write error: {e}")
+                self._spawn(self._store_response(cache_key, message, embedding, list(event_ids), intent, full_response))
             
             # Save to context
             if self.context_manager:
                 self.context_manager.add_message("assistant", full_response)
         
         except Exception as e:
-            print(f"LLM error: {e}")
+            logger.error("LLM error: %s", e)
             fallback = tool_result if tool_result else "Sorry, I'm having trouble. Can you rephrase?"
-            await self.send_reply(fallback)
\ No newline at end of file
+            await self.send_reply(fallback)
+        finally:
+            if timer is not None:
+                timer.cancel()
\ No newline at end of file
@@ -1,6 +1,15 @@
-import json
+import logging
+import re
+import orjson
 from typing import List, Dict, Optional
-from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+HISTORY_LIMIT = 6  # turns kept in context
+
+# Words that point at the most recently mentioned event, matched anywhere in
+# the text as before ("that one"/"this one" are covered by "that"/"this")
+_RE_MOST_RECENT = re.compile(r'that|this|it|first')
 
 class ContextManager:
     """Manages session context for natural conversations with minimal overhead."""
@@ -14,49 +23,108 @@ class ContextManager:
             "last_search_query": None,
             "conversation_history": []  # Last 6 turns only
         }
+        # History lives in its own Redis list so a turn only pushes the new
+        # messages; the rest of the context is a small JSON blob
+        self._dirty = False  # blob fields changed, cleared once persisted
+        self._new_messages = 0  # history entries not yet pushed
+        self._rewrite_history = False  # replace the whole Redis list on next save
+        self._summary: Optional[str] = None  # build_context_summary() result until events/booking change
+    
+    @property
+    def _key(self) -> str:
+        return f"context:{self.phone}"
+    
+    @property
+    def _history_key(self) -> str:
+        return f"context:{self.phone}:hist"
     
     async def load(self):
-        """Load context from Redis."""
+        """Load context and history from Redis in one round trip."""
         if not self.redis:
             return
         
         try:
-            key = f"context:{self.phone}"
-            data = await self.redis.get(key)
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.get(self._key)
+                pipe.lrange(self._history_key, 0, -1)
+                data, history = await pipe.execute()
             if data:
-                self.context = json.loads(data)
+                self.context = orjson.loads(data)
+                self._summary = None
+            if history:
+                self.context["conversation_history"] = [orjson.loads(m) for m in history]
+            elif self.context.get("conversation_history"):
+                # Context saved before history moved out of the blob
+                self._dirty = True
+                self._rewrite_history = True
+            self.context.setdefault("conversation_history", [])
         except Exception as e:
-            print(f"Context load error: {e}")
+            logger.warning("Context load error: %s", e)
     
-    async def save(self):
-        """Save context to Redis with trimming."""
-        if not self.redis:
+    def _trim(self):
+        """Trim history and mentioned events to their caps."""
+        # Trim history to last 6 turns (a context loaded from Redis may exceed it)
+        history = self.context["conversation_history"]
+        if len(history) > HISTORY_LIMIT:
+            del history[:-HISTORY_LIMIT]
+        
+        # Trim mentioned events to last 3
+        if len(self.context["last_mentioned_events"]) > 3:
+            self.context["last_mentioned_events"] = self.context["last_mentioned_events"][:3]
+    
+    @property
+    def dirty(self) -> bool:
+        """Whether the context changed since it was last persisted."""
+        return self._dirty or self._new_messages > 0
+    
+    def mark_dirty(self):
+        """Force the next save to write everything, e.g. after a failed or superseded save."""
+        self._dirty = True
+        self._rewrite_history = True
+    
+    def save_pipeline(self, pipe):
+        """Stage the context writes on a Redis pipeline; the caller executes it.
+        
+        Only changed parts are written: the blob when a field changed, and
+        RPUSH + LTRIM of just the new messages for history.
+        """
+        if not self.dirty:
             return
+        self._trim()
+        if self._dirty:
+            fields = {k: v for k, v in self.context.items() if k != "conversation_history"}
+            pipe.set(self._key, orjson.dumps(fields), ex=3600)  # 1 hour TTL
+        else:
+            pipe.expire(self._key, 3600)
         
-        try:
-            # Trim history to last 6 turns
-            if len(self.context["conversation_history"]) > 6:
-                self.context["conversation_history"] = self.context["conversation_history"][-6:]
-            
-            # Trim mentioned events to last 3
-            if len(self.context["last_mentioned_events"]) > 3:
-                self.context["last_mentioned_events"] = self.context["last_mentioned_events"][:3]
-            
-            key = f"context:{self.phone}"
-            await self.redis.set(key, json.dumps(self.context), ex=3600)  # 1 hour TTL
-        except Exception as e:
-            print(f"Context save error: {e}")
+        history = self.context["conversation_history"]
+        if self._rewrite_history:
+            pipe.delete(self._history_key)
+            new = history
+        else:
+            new = history[len(history) - min(self._new_messages, len(history)):]
+        if new:
+            pipe.rpush(self._history_key, *(orjson.dumps(m) for m in new))
+            pipe.ltrim(self._history_key, -HISTORY_LIMIT, -1)
+            pipe.expire(self._history_key, 3600)
+        
+        self._dirty = False
+        self._new_messages = 0
+        self._rewrite_history = False
     
     def add_message(self, role: str, content: str):
         """Add message to conversation history."""
-        self.context["conversation_history"].append({
-            "role": role,
-            "content": content,
-            "timestamp": datetime.now().isoformat()
-        })
+        self._new_messages += 1
+        history = self.context["conversation_history"]
+        history.append({"role": role, "content": content})
+        # Cap on append so the list never grows past the limit between saves
+        if len(history) > HISTORY_LIMIT:
+            del history[0]
     
     def set_mentioned_events(self, event_ids: List[str]):
         """Update recently mentioned events (keep top 3)."""
+        self._dirty = True
+        self._summary = None
         self.context["last_mentioned_events"] = event_ids[:3]
     
     def get_mentioned_events(self) -> List[str]:
@@ -65,6 +133,8 @@ class ContextManager:
     
     def set_pending_booking(self, event_id: str, quantity: int = 1):
         """Set a pending booking action."""
+        self._dirty = True
+        self._summary = None
         self.context["pending_booking"] = {
             "event_id": event_id,
             "quantity": quantity
@@ -76,10 +146,13 @@ class ContextManager:
     
     def clear_pending_booking(self):
         """Clear pending booking after completion."""
+        self._dirty = True
+        self._summary = None
         self.context["pending_booking"] = None
     
     def set_last_search(self, query: str):
         """Record last search query."""
+        self._dirty = True
         self.context["last_search_query"] = query
     
     def get_last_search(self) -> Optional[str]:
@@ -91,24 +164,22 @@ class ContextManager:
         history = self.context.get("conversation_history", [])
         return history[-limit:]
     
-    def resolve_reference(self, text: str) -> Optional[str]:
+    def resolve_reference(self, text: str, text_lower: Optional[str] = None) -> Optional[str]:
         """
         Resolve references like 'that event', 'the first one', 'it'.
-        Returns event_id if resolvable.
+        Returns event_id if resolvable. Pass text_lower if the caller already has it.
         """
-        text_lower = text.lower()
+        if text_lower is None:
+            text_lower = text.lower()
         mentioned = self.get_mentioned_events()
         
         if not mentioned:
             return None
         
-        # Common reference patterns
-        if any(ref in text_lower for ref in ['that', 'this', 'it', 'that one', 'this one']):
+        # Common reference patterns and "first", in one pass
+        if _RE_MOST_RECENT.search(text_lower):
             return mentioned[0]  # Most recent
         
-        if 'first' in text_lower and len(mentioned) >= 1:
-            return mentioned[0]
-        
         if 'second' in text_lower and len(mentioned) >= 2:
             return mentioned[1]
         
@@ -119,6 +190,8 @@ class ContextManager:
     
     def build_context_summary(self) -> str:
         """Build a minimal context summary for LLM (token-optimized)."""
+        if self._summary is not None:
+            return self._summary
         parts = []
         
         # Recent events (compact format)
@@ -131,4 +204,5 @@ class ContextManager:
             pending = self.context["pending_booking"]
             parts.append(f"Considering: {pending['event_id']} (qty:{pending['quantity']})")
         
-        return " | ".join(parts) if parts else "No prior context"
\ No newline at end of file
+        self._summary = " | ".join(parts) if parts else "No prior context"
+        return self._summary
\ No newline at end of file
@@ -1,38 +1,103 @@
 import os
+import logging
 import aiohttp
 import asyncio
 from typing import List, Dict, Optional
-import google.generativeai as genai
-import json
+import orjson
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
 
 # Configuration
 LLM_PROVIDER = os.getenv("LLM_PROVIDER", "ollama")
 OLLAMA_API_URL = os.getenv("OLLAMA_API_URL", "http://localhost:11434/api/chat")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "mistral")
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "5m")
+# Bound connect and per-read stalls, not the whole stream, so long generations
+# aren't cut off while tokens are still arriving. A cold model load sends
+# nothing until the weights are in memory, so the first line may take up to
+# OLLAMA_LOAD_TIMEOUT; every later line must arrive within OLLAMA_READ_TIMEOUT.
+OLLAMA_LOAD_TIMEOUT = float(os.getenv("OLLAMA_LOAD_TIMEOUT", 120))
+OLLAMA_READ_TIMEOUT = 15
+OLLAMA_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=OLLAMA_LOAD_TIMEOUT)
+# Match the Ollama server's OLLAMA_NUM_PARALLEL so requests beyond it queue here
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", 8))
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-1.5-flash")
 
+# Chat roles Gemini keeps in history; system messages are folded into the prompt
+_GEMINI_ROLES = {"user": "user", "assistant": "model"}
+
+@lru_cache(maxsize=8)
+def _ollama_body_head(max_tokens: int) -> bytes:
+    """Serialized request fields up to the opening of the messages array."""
+    head = orjson.dumps({
+        "model": OLLAMA_MODEL,
+        "stream": True,
+        # Keep the model (and its cached system-prompt prefix) loaded between turns
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+        "options": {
+            "temperature": 0.7,
+            "num_predict": max_tokens
+        }
+    })
+    return head[:-1] + b',"messages":['
+
+
+@lru_cache(maxsize=16)
+def _encode_prefix_message(role: str, content: str) -> bytes:
+    """Serialized leading message; the system prompt is the same every turn."""
+    return orjson.dumps({"role": role, "content": content})
+
+
+def _ollama_body(messages: List[Dict], max_tokens: int) -> bytes:
+    """Build the chat request body, reusing the pre-encoded head and system prompt."""
+    if not messages:
+        return _ollama_body_head(max_tokens) + b']}'
+    first = messages[0]
+    encoded = [_encode_prefix_message(first["role"], first["content"])]
+    encoded.extend(orjson.dumps(msg) for msg in messages[1:])
+    return _ollama_body_head(max_tokens) + b','.join(encoded) + b']}'
+
+
 class LLMProvider:
     """Unified interface for Ollama and Gemini with streaming."""
     
     def __init__(self, provider: str = None):
         self.provider = provider or LLM_PROVIDER
         self.session = None
-        self.gemini_model = None
+        self.gemini_model = None  # configured on first Gemini request
+        self._genai = None
+        self._ollama_slots = None  # created on the running loop in initialize()
         
-        if self.provider == "gemini" and GEMINI_API_KEY:
-            genai.configure(api_key=GEMINI_API_KEY)
-            self.gemini_model = genai.GenerativeModel(GEMINI_MODEL)
-        
-        print(f"🤖 LLM Provider: {self.provider.upper()}")
+        logger.info("LLM provider: %s", self.provider.upper())
     
     async def initialize(self):
-        """Initialize HTTP session for Ollama."""
-        if self.provider == "ollama" and not self.session:
-            self.session = aiohttp.ClientSession()
+        """Initialize the process-wide HTTP session for Ollama (idempotent)."""
+        if self.provider == "ollama" and self._ollama_slots is None:
+            self._ollama_slots = asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+        if self.provider == "ollama" and (not self.session or self.session.closed):
+            # One pooled keep-alive session shared by every conversation
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=100,
+                    limit_per_host=32,
+                    ttl_dns_cache=300,
+                    keepalive_timeout=75
+                )
+            )
+    
+    def _ensure_gemini(self):
+        """Import and configure the Gemini SDK on first use; Ollama-only setups never load it."""
+        if self.gemini_model is None and GEMINI_API_KEY:
+            import google.generativeai as genai
+            genai.configure(api_key=GEMINI_API_KEY)
+            self._genai = genai
+            self.gemini_model = genai.GenerativeModel(GEMINI_MODEL)
+        return self.gemini_model
     
     async def cleanup(self):
-        """Clean up resources."""
+        """Close the shared session; call once at server shutdown."""
         if self.session and not self.session.closed:
             await self.session.close()
     
@@ -47,68 +112,62 @@ class LLMProvider:
     
     async def _generate_ollama(self, messages: List[Dict], max_tokens: int):
         """Generate using Ollama with streaming."""
-        if not self.session:
+        if not self.session or self.session.closed:
             await self.initialize()
         
         try:
-            payload = {
-                "model": OLLAMA_MODEL,
-                "messages": messages,
-                "stream": True,
-                "options": {
-                    "temperature": 0.7,
-                    "num_predict": max_tokens
-                }
-            }
+            body = _ollama_body(messages, max_tokens)
             
-            async with self.session.post(
+            async with self._ollama_slots, self.session.post(
                 OLLAMA_API_URL,
-                json=payload,
-                timeout=aiohttp.ClientTimeout(total=30)
+                data=body,
+                headers={"Content-Type": "application/json"},
+                timeout=OLLAMA_TIMEOUT
             ) as response:
                 if response.status == 200:
-                    async for chunk in response.content.iter_any():
+                    # Ollama streams NDJSON; read whole lines so a record split
+                    # across network chunks is not dropped.
+                    read_timeout = OLLAMA_LOAD_TIMEOUT
+                    while line := await asyncio.wait_for(response.content.readline(), read_timeout):
+                        read_timeout = OLLAMA_READ_TIMEOUT
+                        if not line.strip():
+                            continue
                         try:
-                            data = chunk.decode('utf-8')
-                            for line in data.splitlines():
-                                if line.strip():
-                                    json_data = json.loads(line)
-                                    if "message" in json_data and "content" in json_data['message']:
-                                        yield json_data['message']['content']
-                        except json.JSONDecodeError:
-                            pass
+                            json_data = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            continue
+                        content = json_data.get("message", {}).get("content")
+                        if content:
+                            yield content
+                        if json_data.get("done"):
+                            break
                 else:
                     error_text = await response.text()
-                    print(f"Ollama API error: {response.status} - {error_text}")
+                    logger.error("Ollama API error: %s - %s", response.status, error_text)
                     yield "I'm having trouble thinking right now. Could you try again?"
         
         except asyncio.TimeoutError:
             yield "Sorry, I'm taking too long to respond. Please try again."
         except aiohttp.ClientConnectorError:
-            print("Cannot connect to Ollama")
+            logger.error("Cannot connect to Ollama")
             yield "I can't connect to my brain right now. Please check if Ollama is running."
         except Exception as e:
-            print(f"Ollama error: {e}")
+            logger.error("Ollama error: %s", e)
             yield "I encountered an error. Please try again."
     
     async def _generate_gemini(self, messages: List[Dict], max_tokens: int):
         """Generate using Gemini with streaming (fixed)."""
-        if not self.gemini_model:
+        if not self._ensure_gemini():
             yield "Gemini API not configured. Please set GEMINI_API_KEY."
             return
         
         try:
             # Convert messages to Gemini format
-            gemini_messages = []
-            system_prompt = ""
-            
-            for msg in messages:
-                if msg["role"] == "system":
-                    system_prompt += msg["content"] + "\n"
-                elif msg["role"] == "user":
-                    gemini_messages.append({"role": "user", "parts": [msg["content"]]})
-                elif msg["role"] == "assistant":
-                    gemini_messages.append({"role": "model", "parts": [msg["content"]]})
+            system_prompt = "".join(msg["content"] + "\n" for msg in messages if msg["role"] == "system")
+            gemini_messages = [
+                {"role": _GEMINI_ROLES[msg["role"]], "parts": [msg["content"]]}
+                for msg in messages if msg["role"] in _GEMINI_ROLES
+            ]
             
             # Start chat with history
             chat = self.gemini_model.start_chat(history=gemini_messages[:-1] if len(gemini_messages) > 1 else [])
@@ -118,25 +177,21 @@ class LLMProvider:
             if system_prompt:
                 last_message = f"{system_prompt}\n{last_message}"
             
-            # Generate response with streaming (native sync)
-            response_stream = chat.send_message(
+            # Native async streaming: chunks arrive as the response is read
+            response_stream = await chat.send_message_async(
                 last_message,
-                generation_config=genai.types.GenerationConfig(
+                generation_config=self._genai.types.GenerationConfig(
                     max_output_tokens=max_tokens,
                     temperature=0.7
                 ),
                 stream=True
             )
-            
-            # Stream chunks (sync iteration wrapped in executor)
-            for chunk in response_stream:
+            async for chunk in response_stream:
                 if chunk.text:
                     yield chunk.text
-                # Yield control back to event loop
-                await asyncio.sleep(0)
         
         except Exception as e:
-            print(f"Gemini error: {e}")
+            logger.error("Gemini error: %s", e)
             yield "I encountered an error with Gemini. Please try again."
 
 # Global instance
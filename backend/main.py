@@ -1,27 +1,58 @@
 import asyncio
-import json
+import logging
+import logging.handlers
+import orjson
 import os
+import queue
 import uuid
+import xxhash
 import redis.asyncio as redis
 from aiohttp import web
 import aiohttp_cors
 from aiortc import RTCPeerConnection, RTCSessionDescription
 from bot_logic import ConversationManager
+from llm_provider import llm_provider
 from rag_engine import RAGEngine
+import tools
 from tools import parse_catalog_to_json
 
+logger = logging.getLogger(__name__)
+
 # --- Setup ---
 ROOT = os.path.dirname(__file__)
 FRONTEND_PATH = os.path.abspath(os.path.join(ROOT, '../frontend'))
 KNOWLEDGE_BASE_PATH = os.path.join(ROOT, 'burraa_catalog.txt')
 REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
 REDIS_PORT = int(os.environ.get("REDIS_PORT", 6379))
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 100))
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "WARNING").upper()
+
+STATIC_FILES = {
+    "index.html": "text/html",
+    "client.js": "application/javascript",
+    "style.css": "text/css",
+}
 
 # Global instances
 rag_engine = None
 redis_client = None
-pcs = set()
-conversation_managers = {}
+sessions = {}  # RTCPeerConnection -> its ConversationManager
+cleanup_tasks = set()  # conversation cleanups running off the signalling path
+
+# --- Logging ---
+
+def setup_logging():
+    """Send log records through a queue so coroutines never block on stdout."""
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener.start()
+    return listener
 
 # --- Startup Initialization ---
 
@@ -31,73 +62,122 @@ async def init_rag():
     
     print("🚀 Initializing RAG engine...")
     
+    # Catalog parsing, model load and embedding all block; keep them off the loop
+    rag_engine = await asyncio.to_thread(build_rag_engine)
+    
+    print("✅ RAG engine ready!")
+
+def build_rag_engine() -> RAGEngine:
+    """Parse the catalog, save it as JSON and build the FAISS index (blocking)."""
     # Parse catalog and save as JSON
     kb_data = parse_catalog_to_json()
     json_path = os.path.join(ROOT, 'knowledge_base.json')
     
-    with open(json_path, 'w', encoding='utf-8') as f:
-        json.dump(kb_data, f, indent=2, ensure_ascii=False)
+    with open(json_path, 'wb') as f:
+        f.write(orjson.dumps(kb_data, option=orjson.OPT_INDENT_2))
     
     # Build FAISS index
-    rag_engine = RAGEngine(json_path)
-    rag_engine.build_index()
-    
-    print("✅ RAG engine ready!")
+    engine = RAGEngine(json_path)
+    engine.build_index()
+    return engine
 
 async def init_redis(app):
     """Initialize Redis client (optional)."""
     global redis_client
     try:
-        redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, decode_responses=True)
+        # One bounded pool shared by every conversation; callers wait for a free
+        # connection instead of opening more under load
+        pool = redis.BlockingConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            max_connections=REDIS_MAX_CONNECTIONS,
+            timeout=5,
+            decode_responses=True
+        )
+        redis_client = redis.Redis(connection_pool=pool)
         await redis_client.ping()
-        rag_engine.set_redis(redis_client)  # Enable RAG caching
+        tools.set_redis(redis_client)  # Store bookings in Redis
         app['redis_client'] = redis_client
         print("✅ Connected to Redis (caching enabled)")
+        try:
+            imported = await tools.import_file_bookings()
+            if imported:
+                print(f"📥 Imported {imported} bookings from bookings.json into Redis")
+        except Exception as e:
+            logger.warning("Booking import failed (retried next startup): %s", e)
     except Exception as e:
-        print(f"⚠️  Redis unavailable: {e}")
-        print("ℹ️  Running in stateless mode (no caching)")
+        logger.warning("Redis unavailable, running in stateless mode (no caching): %s", e)
         app['redis_client'] = None
 
+def read_bytes(path: str) -> bytes:
+    """Read a whole file (blocking)."""
+    with open(path, "rb") as f:
+        return f.read()
+
+async def init_static(app):
+    """Read the frontend files once; requests are then served from memory."""
+    app['static'] = {}
+    for name, content_type in STATIC_FILES.items():
+        try:
+            body = await asyncio.to_thread(read_bytes, os.path.join(FRONTEND_PATH, name))
+        except FileNotFoundError:
+            logger.warning("%s not found in %s", name, FRONTEND_PATH)
+            continue
+        etag = f'"{xxhash.xxh3_64_hexdigest(body)}"'
+        app['static'][name] = (body, etag, content_type)
+
 # --- HTTP Route Handlers ---
 
+async def serve_static(request, name: str):
+    """Serves a frontend file from memory, answering 304 when the browser's copy is current."""
+    cached = request.app['static'].get(name)
+    if cached is None:
+        return web.Response(status=404, text=f"{name} not found")
+    
+    body, etag, content_type = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("If-None-Match") == etag:
+        return web.Response(status=304, headers=headers)
+    return web.Response(body=body, content_type=content_type, charset="utf-8", headers=headers)
+
 async def index(request):
     """Serves the main index.html file."""
-    try:
-        with open(os.path.join(FRONTEND_PATH, "index.html"), "r") as f:
-            return web.Response(content_type="text/html", text=f.read())
-    except FileNotFoundError:
-        return web.Response(status=404, text="index.html not found")
+    return await serve_static(request, "index.html")
 
 async def javascript(request):
     """Serves the client.js file."""
-    try:
-        with open(os.path.join(FRONTEND_PATH, "client.js"), "r") as f:
-            return web.Response(content_type="application/javascript", text=f.read())
-    except FileNotFoundError:
-        return web.Response(status=404, text="client.js not found")
+    return await serve_static(request, "client.js")
 
 async def stylesheet(request):
     """Serves the style.css file."""
-    try:
-        with open(os.path.join(FRONTEND_PATH, "style.css"), "r") as f:
-            return web.Response(content_type="text/css", text=f.read())
-    except FileNotFoundError:
-        return web.Response(status=404, text="style.css not found")
+    return await serve_static(request, "style.css")
+
+def cleanup_in_background(manager):
+    """Run a conversation's cleanup without holding up the connection handler."""
+    task = asyncio.create_task(manager.cleanup())
+    cleanup_tasks.add(task)
+    task.add_done_callback(cleanup_tasks.discard)
+
+async def close_session(pc):
+    """Close a peer connection and drop its conversation in one step."""
+    manager = sessions.pop(pc, None)
+    if manager:
+        cleanup_in_background(manager)
+    await pc.close()
 
 async def offer(request):
     """Handles the WebRTC offer from the client."""
     try:
-        params = await request.json()
+        params = await request.json(loads=orjson.loads)
         offer_sdp = RTCSessionDescription(sdp=params["sdp"], type=params["type"])
-    except (json.JSONDecodeError, KeyError):
+    except (orjson.JSONDecodeError, KeyError):
         return web.Response(status=400, text="Invalid offer format")
 
     pc = RTCPeerConnection()
     pc_id = f"PeerConnection({uuid.uuid4()})"
-    pcs.add(pc)
 
     def log_info(msg, *args):
-        print(f"{pc_id} {msg % args}")
+        logger.info("%s " + msg, pc_id, *args)
 
     log_info("Created for %s", request.remote)
 
@@ -107,37 +187,32 @@ async def offer(request):
         rag_engine=rag_engine, 
         redis_client=request.app.get('redis_client')
     )
-    conversation_managers[pc_id] = conversation_manager
+    sessions[pc] = conversation_manager
 
     @pc.on("datachannel")
     def on_datachannel(channel):
-        log_info(f"DataChannel '{channel.label}' created")
+        log_info("DataChannel '%s' created", channel.label)
         conversation_manager.transport = channel
 
         @channel.on("open")
         async def on_open():
-            log_info(f"DataChannel '{channel.label}' is open")
+            log_info("DataChannel '%s' is open", channel.label)
             await conversation_manager.initialize()
 
         @channel.on("message")
         async def on_message(message):
-            log_info(f"Message from client: {message}")
+            logger.debug("%s Message from client: %s", pc_id, message)
             await conversation_manager.handle_message(message)
         
         @channel.on("close")
         def on_close():
-            log_info(f"DataChannel '{channel.label}' closed")
+            log_info("DataChannel '%s' closed", channel.label)
 
     @pc.on("connectionstatechange")
     async def on_connectionstatechange():
         log_info("Connection state is %s", pc.connectionState)
         if pc.connectionState in ["failed", "closed", "disconnected"]:
-            if pc_id in conversation_managers:
-                await conversation_managers[pc_id].cleanup()
-                del conversation_managers[pc_id]
-            
-            await pc.close()
-            pcs.discard(pc)
+            await close_session(pc)
             log_info("PeerConnection closed and removed")
 
     try:
@@ -145,43 +220,53 @@ async def offer(request):
         answer = await pc.createAnswer()
         await pc.setLocalDescription(answer)
     except Exception as e:
-        log_info(f"Error during WebRTC negotiation: {e}")
-        if pc_id in conversation_managers:
-            await conversation_managers[pc_id].cleanup()
-            del conversation_managers[pc_id]
-        await pc.close()
-        pcs.discard(pc)
+        logger.error("%s Error during WebRTC negotiation: %s", pc_id, e)
+        await close_session(pc)
         return web.Response(status=500, text="WebRTC negotiation failed")
 
     return web.Response(
         content_type="application/json",
-        text=json.dumps({"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}),
+        body=orjson.dumps({"sdp": pc.localDescription.sdp, "type": pc.localDescription.type}),
     )
 
 async def on_shutdown(app):
     """Closes all active peer connections and cleans up resources."""
-    cleanup_tasks = [manager.cleanup() for manager in conversation_managers.values()]
-    await asyncio.gather(*cleanup_tasks, return_exceptions=True)
-    conversation_managers.clear()
+    open_sessions = list(sessions.items())
+    sessions.clear()
+    pending = [manager.cleanup() for _, manager in open_sessions]
+    await asyncio.gather(*pending, *cleanup_tasks, return_exceptions=True)
     
-    coros = [pc.close() for pc in pcs]
+    coros = [pc.close() for pc, _ in open_sessions]
     await asyncio.gather(*coros)
-    pcs.clear()
+
+    await llm_provider.cleanup()
 
     if redis_client:
         await redis_client.close()
+        await redis_client.connection_pool.disconnect()
         print("🔌 Redis client closed.")
 
     print("🧹 All peer connections closed and resources cleaned up.")
 
 async def on_startup(app):
     """Initialize services on server startup."""
-    await init_rag()
-    await init_redis(app)
+    # Independent; the RAG build runs in a thread while Redis connects
+    await asyncio.gather(init_static(app), init_rag(), init_redis(app))
+    if app['redis_client']:
+        rag_engine.set_redis(app['redis_client'])  # Enable RAG caching
 
 # --- Main Application Setup ---
 
 if __name__ == "__main__":
+    log_listener = setup_logging()
+    
+    # libuv-backed loop when available (not on Windows); asyncio's default otherwise
+    try:
+        import uvloop
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    except ImportError:
+        pass
+    
     app = web.Application()
     app.on_startup.append(on_startup)
     app.on_shutdown.append(on_shutdown)
@@ -227,4 +312,6 @@ if __name__ == "__main__":
     print("=" * 60)
     print("\n🚀 Starting server...\n")
     
-    web.run_app(app, access_log=None, host="0.0.0.0", port=8080)
\ No newline at end of file
+    # Deeper accept queue for reconnect bursts (the kernel caps it at net.core.somaxconn)
+    web.run_app(app, access_log=None, host="0.0.0.0", port=8080, backlog=1024)
+    log_listener.stop()
\ No newline at end of file
@@ -1,63 +1,158 @@
-import json
+import asyncio
+import logging
+import orjson
 import numpy as np
 import faiss
 import hashlib
+from functools import lru_cache
 from sentence_transformers import SentenceTransformer
 from typing import List, Dict, Optional
 import os
 
+logger = logging.getLogger(__name__)
+
+# Embedding runtime. "onnx" (or "openvino") needs sentence-transformers>=3.2 with
+# optimum installed; EMBEDDING_MODEL_FILE picks a quantized export, e.g.
+# onnx/model_qint8_avx2.onnx
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch")
+EMBEDDING_MODEL_FILE = os.getenv("EMBEDDING_MODEL_FILE")
+# PyTorch backend only: "bfloat16" halves weight bandwidth on CPUs with native
+# BF16 (AVX-512 BF16 / AMX); EMBEDDING_COMPILE=1 wraps the encoder in torch.compile
+EMBEDDING_DTYPE = os.getenv("EMBEDDING_DTYPE", "float32")
+EMBEDDING_COMPILE = os.getenv("EMBEDDING_COMPILE") == "1"
+
+# Built indexes are reused across restarts while the embedded texts and model match
+INDEX_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.rag_cache')
+
+# Cosine similarity floor for search hits. Equals the old 1/(1+d²) > 0.3 cut
+# on L2 distance, since d² = 2 - 2·cos for unit vectors.
+MIN_RELEVANCE = -1 / 6
+
+# Recent query embeddings kept in process (384 floats each), so repeated
+# queries skip the encoder even when Redis is down
+QUERY_EMBEDDING_CACHE_SIZE = 1024
+
 class RAGEngine:
     """Fast semantic search using FAISS with Redis caching."""
     
     def __init__(self, knowledge_base_path: str):
         self.kb_path = knowledge_base_path
-        self.model = SentenceTransformer('all-MiniLM-L6-v2')
+        model_args = {}
+        if EMBEDDING_BACKEND != "torch":
+            model_args["backend"] = EMBEDDING_BACKEND
+            if EMBEDDING_MODEL_FILE:
+                model_args["model_kwargs"] = {"file_name": EMBEDDING_MODEL_FILE}
+        self.model = SentenceTransformer('all-MiniLM-L6-v2', **model_args)
+        if EMBEDDING_BACKEND == "torch":
+            self._tune_torch_model()
+        self.embedding_dim = self.model.get_sentence_embedding_dimension()
         self.index = None
         self.events = []
         self.event_texts = []
+        self._index_by_id = {}  # event ID -> position in self.events
+        self._embed_cached = lru_cache(maxsize=QUERY_EMBEDDING_CACHE_SIZE)(self._encode_one)
+        self._embed_inflight = {}  # text -> running encode, shared by concurrent callers
         self.redis_client = None
         
+    def _tune_torch_model(self):
+        """Apply the opt-in BF16 / torch.compile settings to the encoder."""
+        import torch
+        if EMBEDDING_DTYPE == "bfloat16":
+            self.model = self.model.to(torch.bfloat16)
+        if EMBEDDING_COMPILE:
+            self.model[0].auto_model = torch.compile(self.model[0].auto_model)
+    
     def set_redis(self, redis_client):
         """Set Redis client for caching."""
         self.redis_client = redis_client
         
     def build_index(self):
         """Build FAISS index at startup."""
-        print("🔨 Building FAISS index...")
+        logger.info("Building FAISS index")
         
-        with open(self.kb_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            self.events = data.get('events', [])
+        with open(self.kb_path, 'rb') as f:
+            self.events = orjson.loads(f.read()).get('events', [])
+        
+        # One pass for the ID lookup and the focused searchable text
+        # (name, type, location only)
+        self._index_by_id = {}
+        self.event_texts = []
+        for i, event in enumerate(self.events):
+            self._index_by_id.setdefault(event.get('id'), i)
+            self.event_texts.append(f"{event.get('name', '')} {event.get('type', '')} {event.get('location', '')}")
         
         if not self.events:
-            print("⚠️  No events found in knowledge base")
+            logger.warning("No events found in knowledge base")
             return
         
-        # Create focused searchable text (name, type, location only)
-        self.event_texts = []
-        for event in self.events:
-            text = f"{event.get('name', '')} {event.get('type', '')} {event.get('location', '')}"
-            self.event_texts.append(text)
+        cache_path = self._index_cache_path()
+        if os.path.exists(cache_path):
+            try:
+                self.index = faiss.read_index(cache_path)
+                logger.info("FAISS index loaded from cache with %d events", len(self.events))
+                return
+            except Exception as e:
+                logger.warning("Index cache read error: %s", e)
         
-        # Generate embeddings
-        embeddings = self.model.encode(self.event_texts, show_progress_bar=False)
+        # Generate embeddings (unit length, so inner product is cosine similarity)
+        embeddings = self.model.encode(self.event_texts, show_progress_bar=False, normalize_embeddings=True)
         embeddings = np.array(embeddings).astype('float32')
         
-        # Build FAISS index
+        # Build FAISS index; exact search is cheapest at catalog size
         dimension = embeddings.shape[1]
-        self.index = faiss.IndexFlatL2(dimension)
+        self.index = faiss.IndexFlatIP(dimension)
         self.index.add(embeddings)
         
-        print(f"✅ FAISS index built with {len(self.events)} events")
+        try:
+            os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{cache_path}.tmp"
+            faiss.write_index(self.index, tmp_path)
+            os.replace(tmp_path, cache_path)
+        except Exception as e:
+            logger.warning("Index cache write error: %s", e)
+        
+        logger.info("FAISS index built with %d events", len(self.events))
+    
+    def _index_cache_path(self) -> str:
+        """Cache file for the current event texts, model and index type."""
+        h = hashlib.sha256()
+        h.update(f"all-MiniLM-L6-v2:{EMBEDDING_BACKEND}:{EMBEDDING_MODEL_FILE}:{EMBEDDING_DTYPE}:IndexFlatIP\n".encode())
+        h.update("\n".join(self.event_texts).encode('utf-8'))
+        return os.path.join(INDEX_CACHE_DIR, f"{h.hexdigest()[:16]}.faiss")
+    
+    def _encode_one(self, text: str) -> np.ndarray:
+        """Encode one text (blocking). Results are shared via the LRU; don't mutate them."""
+        embedding = self.model.encode([text], show_progress_bar=False, normalize_embeddings=True)
+        return np.asarray(embedding[0], dtype='float32')
+    
+    async def embed(self, text: str) -> np.ndarray:
+        """Embed a single text as a normalized float32 vector.
+        
+        Concurrent calls for the same text (the semantic-cache lookup and the
+        search it runs alongside) await one encode; the LRU can't merge
+        misses that are still in flight.
+        """
+        task = self._embed_inflight.get(text)
+        if task is None:
+            task = asyncio.ensure_future(asyncio.to_thread(self._embed_cached, text))
+            self._embed_inflight[text] = task
+            task.add_done_callback(lambda _: self._embed_inflight.pop(text, None))
+        # One caller being cancelled must not cancel the encode for the others
+        return await asyncio.shield(task)
     
     def _cache_key(self, query: str, top_k: int) -> str:
         """Generate cache key for search query."""
         hash_input = f"{query.lower().strip()}:{top_k}"
         return f"rag:search:{hashlib.md5(hash_input.encode()).hexdigest()}"
     
+    def _search_index(self, query_embedding: np.ndarray, top_k: int):
+        """Search the FAISS index with one query embedding."""
+        return self.index.search(query_embedding[np.newaxis, :], min(top_k, len(self.events)))
+    
     async def search(self, query: str, top_k: int = 5) -> List[Dict]:
         """Search for events with Redis caching."""
-        if not self.index or not self.events:
+        # One- and two-character queries carry no searchable meaning; skip the encoder
+        if not self.index or not self.events or len(query.strip()) < 3:
             return []
         
         # Try cache first
@@ -66,52 +161,41 @@ class RAGEngine:
                 cache_key = self._cache_key(query, top_k)
                 cached = await self.redis_client.get(cache_key)
                 if cached:
-                    print(f"📦 Cache hit for query: {query[:30]}...")
-                    return json.loads(cached)
+                    logger.debug("Search cache hit for query: %.30s", query)
+                    return orjson.loads(cached)
             except Exception as e:
-                print(f"Cache read error: {e}")
+                logger.warning("Search cache read error: %s", e)
         
-        # Perform search
-        query_embedding = self.model.encode([query], show_progress_bar=False)
-        query_embedding = np.array(query_embedding).astype('float32')
+        # Encoding runs off the event loop; exact search over the catalog-sized
+        # flat index takes microseconds, so it runs inline
+        scores, indices = self._search_index(await self.embed(query), top_k)
         
-        distances, indices = self.index.search(query_embedding, min(top_k, len(self.events)))
+        # Filter by relevance threshold (and FAISS's -1 padding) before copying events
+        keep = (scores[0] > MIN_RELEVANCE) & (indices[0] >= 0) & (indices[0] < len(self.events))
+        results = [
+            {**self.events[idx], '_relevance': score}
+            for idx, score in zip(indices[0][keep].tolist(), scores[0][keep].tolist())
+        ]
         
-        results = []
-        for dist, idx in zip(distances[0], indices[0]):
-            if idx < len(self.events):
-                event = self.events[idx].copy()
-                event['_relevance'] = float(1 / (1 + dist))
-                results.append(event)
-        
-        # Filter by relevance threshold
-        results = [r for r in results if r['_relevance'] > 0.3]
-        
-        # Cache results
-        if self.redis_client and results:
+        # Cache results; misses too (shorter TTL) so repeated no-match queries skip the encoder
+        if self.redis_client:
             try:
                 cache_key = self._cache_key(query, top_k)
-                await self.redis_client.set(cache_key, json.dumps(results), ex=900)  # 15min TTL
+                await self.redis_client.set(cache_key, orjson.dumps(results), ex=900 if results else 300)  # 15min / 5min TTL
             except Exception as e:
-                print(f"Cache write error: {e}")
+                logger.warning("Search cache write error: %s", e)
         
         return results
     
     def get_event_by_id(self, event_id: str) -> Optional[Dict]:
         """Get specific event by ID."""
-        for event in self.events:
-            if event.get('id') == event_id:
-                return event
-        return None
+        idx = self._index_by_id.get(event_id)
+        return self.events[idx] if idx is not None else None
     
     async def find_similar_events(self, event_id: str, top_k: int = 3) -> List[Dict]:
         """Find events similar to a given event."""
-        source_event = self.get_event_by_id(event_id)
-        if not source_event:
-            return []
-        
-        source_idx = next((i for i, e in enumerate(self.events) if e.get('id') == event_id), -1)
-        if source_idx == -1:
+        source_idx = self._index_by_id.get(event_id)
+        if source_idx is None or not self.events[source_idx]:
             return []
         
         query_text = self.event_texts[source_idx]
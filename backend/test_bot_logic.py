@@ -0,0 +1,464 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import numpy as np
+import orjson
+import pytest
+from redis.exceptions import ConnectionError, ResponseError
+
+import bot_logic
+import tools
+from bot_logic import ConversationManager, _is_phone_number
+from context_manager import ContextManager
+
+
+class _Context:
+    """Context stand-in that resolves every reference to one event."""
+
+    def resolve_reference(self, message, msg_lower=None):
+        return "evt001"
+
+
+@pytest.fixture
+def manager():
+    manager = ConversationManager(None, None, None)
+    manager.context_manager = _Context()
+    return manager
+
+
+@pytest.mark.parametrize("message", [
+    "what's its price?",
+    "its info",
+    "tell me about its venue",
+    "item price",
+])
+def test_details_reference_word_may_start_a_longer_word(manager, message):
+    intent = manager.extract_intent(message)
+    assert intent["type"] == "details"
+    assert intent["event_id"] == "evt001"
+
+
+def test_details_keyword_must_be_a_whole_word(manager):
+    assert manager.extract_intent("pricey, isn't it?")["type"] == "search"
+
+
+@pytest.mark.parametrize("message, booking_id", [
+    ("cancel getic_5", "tic_5"),
+    ("remove tic_tic_5", "tic_tic_5"),
+])
+def test_cancel_finds_ids_overlapping_other_keywords(manager, message, booking_id):
+    assert manager.extract_intent(message)["booking_id"] == booking_id
+
+
+def test_ticket_noun_inside_a_keyword_still_counts(manager):
+    assert manager.extract_intent("show iticket")["type"] == "my_tickets"
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("9876543210", True),
+    ("0000000000", True),
+    ("987654321", False),
+    ("98765432100", False),
+    ("98765 4321", False),
+    ("987654321/", False),
+    ("987654321:", False),
+    ("98765432١٠", False),
+])
+def test_is_phone_number(text, expected):
+    assert _is_phone_number(text) is expected
+
+
+# --- In-memory Redis stand-in ---
+
+class _Pipeline:
+    def __init__(self, redis):
+        self._redis = redis
+        self._calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        self._calls = []
+
+    def __getattr__(self, name):
+        method = getattr(self._redis, name)
+        return lambda *args, **kwargs: self._calls.append((method, args, kwargs))
+
+    async def execute(self):
+        await asyncio.sleep(self._redis.latency)
+        calls, self._calls = self._calls, []
+        return [await method(*args, **kwargs) for method, args, kwargs in calls]
+
+
+class _Search:
+    def __init__(self):
+        self.docs = []
+        self.create_error = None
+        self.created = 0
+
+    async def create_index(self, schema, definition=None):
+        self.created += 1
+        if self.create_error:
+            raise self.create_error
+
+    async def search(self, query, query_params=None):
+        return SimpleNamespace(docs=self.docs)
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.ttl = {}
+        self.latency = 0
+        self.search = _Search()
+
+    def pipeline(self, transaction=True):
+        return _Pipeline(self)
+
+    def ft(self, index_name):
+        return self.search
+
+    async def get(self, key):
+        return self.data.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value
+        self.ttl[key] = ex
+
+    async def expire(self, key, seconds):
+        if key not in self.data:
+            return False
+        self.ttl[key] = seconds
+        return True
+
+    async def delete(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    async def rpush(self, key, *values):
+        self.data.setdefault(key, []).extend(values)
+        return len(self.data[key])
+
+    async def ltrim(self, key, start, end):
+        values = self.data.get(key, [])
+        self.data[key] = values[start:end + 1 or None]
+
+    async def lrange(self, key, start, end):
+        return list(self.data.get(key, [])[start:end + 1 or None])
+
+    async def hset(self, key, field=None, value=None, mapping=None):
+        fields = self.data.setdefault(key, {})
+        fields.update(mapping or {field: value})
+
+    async def hsetnx(self, key, field, value):
+        fields = self.data.setdefault(key, {})
+        if field in fields:
+            return False
+        fields[field] = value
+        return True
+
+    async def hget(self, key, field):
+        return self.data.get(key, {}).get(field)
+
+    async def hdel(self, key, *fields):
+        return sum(self.data.get(key, {}).pop(field, None) is not None for field in fields)
+
+    async def hvals(self, key):
+        return list(self.data.get(key, {}).values())
+
+
+class DownRedis(FakeRedis):
+    """Every command fails as if the server went away."""
+
+    async def _refused(self, *args, **kwargs):
+        raise ConnectionError("Connection refused")
+
+    hset = hget = hdel = hvals = _refused
+
+
+# --- Bookings ---
+
+EVENTS = {"evt001": {"id": "evt001", "name": "Sunburn", "price": "₹1,500", "tickets_available": 10}}
+
+
+@pytest.fixture
+def bookings(tmp_path, monkeypatch):
+    """File-mode booking store rooted in tmp_path."""
+    monkeypatch.setattr(tools, "BOOKINGS_PATH", str(tmp_path / "bookings.json"))
+    monkeypatch.setattr(tools, "BOOKINGS_LOG_PATH", str(tmp_path / "bookings.log.jsonl"))
+    monkeypatch.setattr(tools, "_bookings_cache", None)
+    monkeypatch.setattr(tools, "_bookings_lock", asyncio.Lock())
+    monkeypatch.setattr(tools, "_events_by_id", lambda: EVENTS)
+    monkeypatch.setattr(tools, "_redis", None)
+    return tmp_path
+
+
+def _booking_ids(result):
+    return sorted(b["booking_id"] for b in result.get("data", []))
+
+
+def test_file_bookings_survive_a_reload(bookings):
+    async def run():
+        booked = await asyncio.gather(*(tools.book_ticket("evt001", 2, "9876543210") for _ in range(3)))
+        cancelled = await tools.cancel_ticket(booked[0]["data"]["booking_id"], "9876543210")
+        assert cancelled["status"] == "success"
+        tools._bookings_cache = None  # as after a restart
+        return booked, await tools.get_my_tickets("9876543210")
+
+    booked, mine = asyncio.run(run())
+    assert booked[0]["data"]["total_price"] == 3000
+    assert _booking_ids(mine) == sorted(b["data"]["booking_id"] for b in booked[1:])
+    assert len(set(b["data"]["booking_id"] for b in booked)) == 3
+
+
+def test_file_booking_log_compacts_into_the_snapshot(bookings, monkeypatch):
+    monkeypatch.setattr(tools, "BOOKINGS_COMPACT_AT", 3)
+
+    async def run():
+        for _ in range(4):
+            await tools.book_ticket("evt001", 1, "9876543210")
+        tools._bookings_cache = None
+        return await tools.get_my_tickets("9876543210")
+
+    assert len(asyncio.run(run())["data"]) == 4
+    assert len(orjson.loads((bookings / "bookings.json").read_bytes())["9876543210"]) == 3
+    assert (bookings / "bookings.log.jsonl").read_bytes().count(b"\n") == 1
+
+
+def test_file_booking_replay_is_idempotent(bookings):
+    booked = asyncio.run(tools.book_ticket("evt001", 1, "9876543210"))["data"]
+    op = {"op": "book", "phone": "9876543210", "booking": booked}
+    with open(tools.BOOKINGS_LOG_PATH, "ab") as f:
+        f.write(orjson.dumps(op) + b"\n" + b'{"op": "bo')  # duplicate plus a torn append
+    tools._bookings_cache = None
+    assert _booking_ids(asyncio.run(tools.get_my_tickets("9876543210"))) == [booked["booking_id"]]
+
+
+def test_redis_bookings_book_list_and_cancel(bookings):
+    redis = FakeRedis()
+    tools.set_redis(redis)
+
+    async def run():
+        first = await tools.book_ticket("evt001", 1, "9876543210")
+        second = await tools.book_ticket("evt001", 2, "9876543210")
+        listed = await tools.get_my_tickets("9876543210")
+        cancelled = await tools.cancel_ticket(first["data"]["booking_id"], "9876543210")
+        missing = await tools.cancel_ticket(first["data"]["booking_id"], "9876543210")
+        return first, second, listed, cancelled, missing, await tools.get_my_tickets("9876543210")
+
+    first, second, listed, cancelled, missing, after = asyncio.run(run())
+    assert _booking_ids(listed) == sorted([first["data"]["booking_id"], second["data"]["booking_id"]])
+    assert cancelled["status"] == "success"
+    assert missing["status"] == "error"
+    assert _booking_ids(after) == [second["data"]["booking_id"]]
+    assert not (bookings / "bookings.log.jsonl").exists()
+
+
+def test_redis_booking_errors_are_reported_not_raised(bookings):
+    tools.set_redis(DownRedis())
+
+    async def run():
+        return (await tools.book_ticket("evt001", 1, "9876543210"),
+                await tools.cancel_ticket("tic_1", "9876543210"),
+                await tools.get_my_tickets("9876543210"))
+
+    for result in asyncio.run(run()):
+        assert result == tools._STORE_UNAVAILABLE
+
+
+def test_file_bookings_import_into_redis_once(bookings):
+    old = {"booking_id": "tic_1", "booked_at": "2024-01-01T10:00:00", "event_name": "Sunburn"}
+    (bookings / "bookings.json").write_bytes(orjson.dumps({"9876543210": [old, {**old, "booked_at": "2024-01-01T10:00:00.5"}]}))
+    redis = FakeRedis()
+    tools.set_redis(redis)
+
+    assert asyncio.run(tools.import_file_bookings()) == 2
+    assert len(redis.data["bookings:9876543210"]) == 2
+    assert (bookings / "bookings.json.imported").exists()
+    assert not (bookings / "bookings.json").exists()
+    assert asyncio.run(tools.import_file_bookings()) == 0
+
+
+# --- Context persistence ---
+
+def _history(redis, phone="9876543210"):
+    return [orjson.loads(m)["content"] for m in redis.data.get(f"context:{phone}:hist", [])]
+
+
+def _save(context):
+    async def run():
+        async with context.redis.pipeline(transaction=False) as pipe:
+            context.save_pipeline(pipe)
+            await pipe.execute()
+    asyncio.run(run())
+
+
+def test_context_round_trips_through_redis():
+    redis = FakeRedis()
+    context = ContextManager(redis, "9876543210")
+    context.set_mentioned_events(["evt001"])
+    context.add_message("user", "concerts")
+    _save(context)
+
+    loaded = ContextManager(redis, "9876543210")
+    asyncio.run(loaded.load())
+    assert loaded.get_mentioned_events() == ["evt001"]
+    assert loaded.get_conversation_history() == [{"role": "user", "content": "concerts"}]
+    assert "conversation_history" not in orjson.loads(redis.data["context:9876543210"])
+    assert not loaded.dirty
+
+
+def test_context_save_pushes_only_new_messages():
+    redis = FakeRedis()
+    context = ContextManager(redis, "9876543210")
+    for i in range(4):
+        context.add_message("user", f"m{i}")
+    _save(context)
+    pushed = []
+    rpush = redis.rpush
+
+    async def recording_rpush(key, *values):
+        pushed.extend(orjson.loads(v)["content"] for v in values)
+        return await rpush(key, *values)
+
+    redis.rpush = recording_rpush
+    for i in range(4, 8):
+        context.add_message("user", f"m{i}")
+    _save(context)
+
+    assert _history(redis) == [f"m{i}" for i in range(2, 8)]
+    assert pushed == ["m4", "m5", "m6", "m7"]
+    assert "context:9876543210" not in redis.data  # new messages alone never rewrite the blob
+    loaded = ContextManager(redis, "9876543210")
+    asyncio.run(loaded.load())
+    assert [m["content"] for m in loaded.get_conversation_history()] == [f"m{i}" for i in range(2, 8)]
+
+
+def test_context_migrates_history_out_of_a_legacy_blob():
+    redis = FakeRedis()
+    legacy = {"last_mentioned_events": ["evt001"], "pending_booking": None, "last_search_query": "food",
+              "conversation_history": [{"role": "user", "content": f"m{i}"} for i in range(8)]}
+    redis.data["context:9876543210"] = orjson.dumps(legacy)
+
+    context = ContextManager(redis, "9876543210")
+    asyncio.run(context.load())
+    assert context.dirty
+    _save(context)
+
+    assert _history(redis) == [f"m{i}" for i in range(2, 8)]
+    assert "conversation_history" not in orjson.loads(redis.data["context:9876543210"])
+    assert orjson.loads(redis.data["context:9876543210"])["last_search_query"] == "food"
+
+
+def test_cancelled_save_is_retried_on_cleanup():
+    redis = FakeRedis()
+    redis.latency = 0.05
+    manager = ConversationManager(None, None, redis)
+    manager.phone_number = "9876543210"
+    manager.context_manager = ContextManager(redis, "9876543210")
+    manager.context_manager.add_message("user", "concerts")
+
+    async def run():
+        save = asyncio.create_task(manager._save_context())
+        await asyncio.sleep(0.01)
+        save.cancel()
+        await asyncio.gather(save, return_exceptions=True)
+        assert manager.context_manager.dirty
+        assert _history(redis) == []
+        await manager.cleanup()
+
+    asyncio.run(run())
+    assert _history(redis) == ["concerts"]
+    assert not manager.context_manager.dirty
+
+
+# --- Semantic cache ---
+
+class _Rag:
+    embedding_dim = 4
+
+    def __init__(self):
+        self.embedded = []
+
+    async def embed(self, text):
+        self.embedded.append(text)
+        return np.ones(self.embedding_dim, dtype=np.float32)
+
+
+class _Transport:
+    readyState = "open"
+
+    def __init__(self):
+        self.sent = []
+
+    def send(self, data):
+        self.sent.append(data)
+
+
+@pytest.fixture
+def semantic(monkeypatch):
+    monkeypatch.setattr(bot_logic, "_semantic_index_ready", None)
+    monkeypatch.setattr(bot_logic, "_semantic_index_retry_at", 0.0)
+    redis = FakeRedis()
+    manager = ConversationManager(_Transport(), _Rag(), redis)
+    manager.context_manager = ContextManager(redis, "9876543210")
+    return manager
+
+
+def test_semantic_cache_miss_keeps_the_embedding_for_the_store(semantic):
+    intent = semantic.extract_intent("any concerts")
+
+    async def run():
+        replied, embedding = await semantic._try_semantic_cache("any concerts", intent)
+        await semantic._store_response("llm:key", "any concerts", embedding, ["evt001"], intent, "Try Sunburn.")
+        return replied, embedding
+
+    replied, embedding = asyncio.run(run())
+    assert not replied
+    assert embedding == np.ones(4, dtype=np.float32).tobytes()
+    assert semantic.rag.embedded == ["any concerts"]
+    key, = (k for k in semantic.redis_client.data if k.startswith(bot_logic.SEMANTIC_PREFIX))
+    assert semantic.redis_client.data[key]["event_ids"] == "evt001"
+    assert semantic.redis_client.ttl[key] == 300
+    assert semantic.transport.sent == []
+
+
+def test_semantic_cache_hit_replies_and_restores_context(semantic):
+    semantic.redis_client.search.docs = [SimpleNamespace(distance="0.02", response="Try Sunburn.", event_ids="evt001,evt002")]
+    intent = semantic.extract_intent("any concerts")
+
+    replied, embedding = asyncio.run(semantic._try_semantic_cache("any concerts", intent))
+    assert replied and embedding is None
+    assert semantic.transport.sent == ["[COMPLETE]Try Sunburn.\n"]
+    assert semantic.context_manager.get_mentioned_events() == ["evt001", "evt002"]
+    assert semantic.cache_hits == 1
+
+
+def test_semantic_cache_ignores_distant_matches(semantic):
+    semantic.redis_client.search.docs = [SimpleNamespace(distance="0.5", response="Try Sunburn.", event_ids="")]
+    replied, embedding = asyncio.run(semantic._try_semantic_cache("any concerts", semantic.extract_intent("any concerts")))
+    assert not replied and embedding is not None
+
+
+def test_semantic_cache_disabled_without_redisearch(semantic):
+    semantic.redis_client.search.create_error = ResponseError("unknown command 'FT.CREATE'")
+
+    async def run():
+        return [await semantic._try_semantic_cache("any concerts", semantic.extract_intent("any concerts")) for _ in range(2)]
+
+    assert asyncio.run(run()) == [(False, None)] * 2
+    assert semantic.redis_client.search.created == 1
+    assert bot_logic._semantic_index_ready is False
+
+
+def test_semantic_index_setup_retries_after_a_transient_error(semantic, monkeypatch):
+    semantic.redis_client.search.create_error = ConnectionError("Connection refused")
+    assert not asyncio.run(semantic._ensure_semantic_index())
+    assert not asyncio.run(semantic._ensure_semantic_index())
+    assert semantic.redis_client.search.created == 1
+    assert bot_logic._semantic_index_ready is None
+
+    semantic.redis_client.search.create_error = None
+    monkeypatch.setattr(bot_logic, "_semantic_index_retry_at", time.monotonic() - 1)
+    assert asyncio.run(semantic._ensure_semantic_index())
@@ -1,51 +1,143 @@
-import json
-import aiofiles
+import asyncio
+import logging
+import orjson
 import os
+import uuid
 from datetime import datetime
 import re
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
 
 # --- File Paths ---
 KNOWLEDGE_BASE_PATH = os.path.join(os.path.dirname(__file__), 'burraa_catalog.txt')
 BOOKINGS_PATH = os.path.join(os.path.dirname(__file__), 'bookings.json')
+BOOKINGS_LOG_PATH = os.path.join(os.path.dirname(__file__), 'bookings.log.jsonl')
+
+_PRICE_RE = re.compile(r'[\d,]+')
+
+# Catalog records are separated by a dashed line; fields are "Key: value" lines
+_CATALOG_SEP = '-' * 80
+_FIELD_RE = re.compile(r'^([^:\n]*):(.*)$', re.M)
+_catalog_cache = None  # (mtime_ns, parsed catalog)
+
+# Bookings live in Redis (hash bookings:{phone}, one field per booking) when it
+# is available. The stateless-mode fallback is a bookings.json snapshot plus an
+# append-only log of book/cancel ops, folded into the snapshot every
+# BOOKINGS_COMPACT_AT entries
+_redis = None
+_EVENTS_BY_ID = None  # (parsed catalog, events by ID)
+BOOKINGS_COMPACT_AT = 200
+_bookings_cache = None  # (snapshot mtime_ns, log mtime_ns, bookings by phone, log entries)
+_bookings_lock = asyncio.Lock()
+_STORE_UNAVAILABLE = {"status": "error", "message": "I can't reach the booking system right now. Please try again in a moment."}
+
+def set_redis(redis_client):
+    """Set Redis client for booking storage."""
+    global _redis
+    _redis = redis_client
+
+def _events_by_id():
+    """Catalog events keyed by ID, rebuilt only when the parsed catalog changes."""
+    global _EVENTS_BY_ID
+    kb_data = parse_catalog_to_json()
+    if _EVENTS_BY_ID is None or _EVENTS_BY_ID[0] is not kb_data:
+        _EVENTS_BY_ID = (kb_data, {event['id']: event for event in kb_data.get('events', [])})
+    return _EVENTS_BY_ID[1]
 
 # --- Helper Functions ---
-async def read_json_file(path):
+def _read_json_sync(path):
     try:
-        async with aiofiles.open(path, 'r') as f:
-            content = await f.read()
-            return json.loads(content) if content else {}
+        with open(path, 'rb') as f:
+            content = f.read()
+        return orjson.loads(content) if content else {}
     except FileNotFoundError:
         return {}
 
-async def write_json_file(path, data):
-    async with aiofiles.open(path, 'w') as f:
-        await f.write(json.dumps(data, indent=2))
+def _write_json_sync(path, data):
+    # Write to a temp file and swap it in, so readers never see a partial file
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(orjson.dumps(data))
+    os.replace(tmp_path, path)
+
+def _mtime_ns(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+def _apply_booking_op(bookings_db, op):
+    """Fold one log entry into bookings_db. Replaying an entry twice is a no-op."""
+    user_bookings = bookings_db.setdefault(op['phone'], [])
+    booking = op['booking']
+    key = (booking['booking_id'], booking.get('booked_at'))
+    existing = next((b for b in user_bookings if (b.get('booking_id'), b.get('booked_at')) == key), None)
+    if op['op'] == 'book' and existing is None:
+        user_bookings.append(booking)
+    elif op['op'] == 'cancel' and existing is not None:
+        user_bookings.remove(existing)
+    if not user_bookings:
+        del bookings_db[op['phone']]
+
+def _load_bookings_sync():
+    """Snapshot plus replayed log, re-read only when either file changes on disk."""
+    global _bookings_cache
+    snapshot_mtime, log_mtime = _mtime_ns(BOOKINGS_PATH), _mtime_ns(BOOKINGS_LOG_PATH)
+    if _bookings_cache and _bookings_cache[:2] == (snapshot_mtime, log_mtime):
+        return _bookings_cache[2]
+    
+    bookings_db = _read_json_sync(BOOKINGS_PATH)
+    entries = 0
+    if log_mtime is not None:
+        with open(BOOKINGS_LOG_PATH, 'rb') as f:
+            for line in f:
+                try:
+                    _apply_booking_op(bookings_db, orjson.loads(line))
+                except orjson.JSONDecodeError:
+                    continue  # torn final line from an interrupted append
+                entries += 1
+    _bookings_cache = (snapshot_mtime, log_mtime, bookings_db, entries)
+    return bookings_db
+
+def _log_booking_op_sync(bookings_db, op):
+    """Append op to the log and apply it to the cached bookings; compact when the log is long."""
+    global _bookings_cache
+    with open(BOOKINGS_LOG_PATH, 'ab') as f:
+        f.write(orjson.dumps(op) + b'\n')
+    _apply_booking_op(bookings_db, op)
+    
+    entries = _bookings_cache[3] + 1 if _bookings_cache else 1
+    if entries >= BOOKINGS_COMPACT_AT:
+        # Snapshot first: if the log removal is lost, replay is idempotent
+        _write_json_sync(BOOKINGS_PATH, bookings_db)
+        os.remove(BOOKINGS_LOG_PATH)
+        entries = 0
+    _bookings_cache = (_mtime_ns(BOOKINGS_PATH), _mtime_ns(BOOKINGS_LOG_PATH), bookings_db, entries)
 
 def parse_catalog_to_json():
-    """Parse the catalog text file into structured JSON."""
+    """Parse the catalog text file into structured JSON (cached until the file changes)."""
+    global _catalog_cache
     events = []
     
     try:
+        mtime = os.stat(KNOWLEDGE_BASE_PATH).st_mtime_ns
+        if _catalog_cache and _catalog_cache[0] == mtime:
+            return _catalog_cache[1]
+        
         with open(KNOWLEDGE_BASE_PATH, 'r', encoding='utf-8') as f:
             content = f.read()
         
-        # Split by separator
-        records = content.split('--------------------------------------------------------------------------------')
-        
+        # Split by separator; one regex pass per record finds its "Key: value" lines
         event_id_counter = 1
-        for record in records:
-            if not record.strip() or 'BURRAA_CATALOG' in record:
+        for record in content.split(_CATALOG_SEP):
+            if 'BURRAA_CATALOG' in record:
                 continue
             
-            lines = [line.strip() for line in record.strip().split('\n') if line.strip()]
-            
-            event = {}
-            for line in lines:
-                if ':' in line:
-                    key, value = line.split(':', 1)
-                    key = key.strip().lower().replace(' ', '_')
-                    value = value.strip()
-                    event[key] = value
+            event = {
+                key.strip().lower().replace(' ', '_'): value.strip()
+                for key, value in _FIELD_RE.findall(record)
+            }
             
             if event.get('name'):
                 event['id'] = f"evt{event_id_counter:03d}"
@@ -53,19 +145,58 @@ def parse_catalog_to_json():
                 events.append(event)
                 event_id_counter += 1
         
-        return {"events": events}
+        result = {"events": events}
+        _catalog_cache = (mtime, result)
+        return result
     
     except Exception as e:
-        print(f"Error parsing catalog: {e}")
+        logger.error("Error parsing catalog: %s", e)
         return {"events": []}
 
+def _new_booking_id():
+    """Random booking ID; a same-second timestamp ID could overwrite a booking."""
+    return f"tic_{uuid.uuid4().hex[:10]}"
+
+def _retire_booking_files_sync():
+    global _bookings_cache
+    for path in (BOOKINGS_PATH, BOOKINGS_LOG_PATH):
+        if os.path.exists(path):
+            os.replace(path, f"{path}.imported")
+    _bookings_cache = None
+
+async def import_file_bookings():
+    """Move stateless-mode bookings into Redis once, so they stay listable and cancellable.
+    
+    The files are renamed to *.imported afterwards, so later startups don't
+    bring back bookings cancelled in Redis. Returns the number imported.
+    """
+    async with _bookings_lock:
+        bookings_db = await asyncio.to_thread(_load_bookings_sync)
+        if not bookings_db:
+            return 0
+        
+        count = 0
+        async with _redis.pipeline(transaction=False) as pipe:
+            for phone_number, user_bookings in bookings_db.items():
+                seen = set()
+                for booking in user_bookings:
+                    # Old timestamp IDs can repeat within one phone's bookings
+                    if booking['booking_id'] in seen:
+                        booking = {**booking, "booking_id": _new_booking_id()}
+                    seen.add(booking['booking_id'])
+                    pipe.hsetnx(f"bookings:{phone_number}", booking['booking_id'], orjson.dumps(booking))
+                    count += 1
+            await pipe.execute()
+        
+        await asyncio.to_thread(_retire_booking_files_sync)
+        return count
+
 # --- Booking Tools ---
 
 async def book_ticket(event_id: str, quantity: int, phone_number: str):
     """Book tickets for an event."""
-    # Load events from parsed catalog
-    kb_data = parse_catalog_to_json()
-    events = {event['id']: event for event in kb_data.get('events', [])}
+    # Stats (and on change re-reads) the catalog file, so run it off the loop
+    events = await asyncio.to_thread(_events_by_id)
     
     if event_id not in events:
         return {"status": "error", "message": f"Event ID '{event_id}' not found."}
@@ -79,12 +210,11 @@ async def book_ticket(event_id: str, quantity: int, phone_number: str):
         }
     
     # Create booking
-    bookings_db = await read_json_file(BOOKINGS_PATH)
-    booking_id = f"tic_{int(datetime.now().timestamp())}"
+    booking_id = _new_booking_id()
     
     # Extract price (remove currency symbols)
     price_str = event.get('price', '₹0')
-    price_match = re.search(r'[\d,]+', price_str.replace('₹', '').replace(',', ''))
+    price_match = _PRICE_RE.search(price_str.replace('₹', '').replace(',', ''))
     price = int(price_match.group()) if price_match else 0
     
     booking = {
@@ -101,33 +231,54 @@ async def book_ticket(event_id: str, quantity: int, phone_number: str):
         "status": "confirmed"
     }
     
-    if phone_number not in bookings_db:
-        bookings_db[phone_number] = []
-    bookings_db[phone_number].append(booking)
-    
-    await write_json_file(BOOKINGS_PATH, bookings_db)
+    if _redis:
+        try:
+            await _redis.hset(f"bookings:{phone_number}", booking_id, orjson.dumps(booking))
+        except (RedisError, OSError) as e:
+            logger.warning("Booking store error: %s", e)
+            return dict(_STORE_UNAVAILABLE)
+    else:
+        # Serialise log appends against the cached bookings they update
+        async with _bookings_lock:
+            bookings_db = await asyncio.to_thread(_load_bookings_sync)
+            op = {"op": "book", "phone": phone_number, "booking": booking}
+            await asyncio.to_thread(_log_booking_op_sync, bookings_db, op)
     
     return {"status": "success", "data": booking}
 
 
 async def cancel_ticket(booking_id: str, phone_number: str):
     """Cancel a ticket booking."""
-    bookings_db = await read_json_file(BOOKINGS_PATH)
-    user_bookings = bookings_db.get(phone_number, [])
-    
-    ticket_to_cancel = next((b for b in user_bookings if b.get('booking_id') == booking_id), None)
-    
-    if not ticket_to_cancel:
-        return {"status": "error", "message": f"Booking ID '{booking_id}' not found."}
-    
-    # Remove from user's bookings
-    user_bookings.remove(ticket_to_cancel)
-    bookings_db[phone_number] = user_bookings
-    
-    if not user_bookings:
-        del bookings_db[phone_number]
+    if _redis:
+        # Read and remove in one MULTI round trip; HDEL of a missing field is a no-op
+        key = f"bookings:{phone_number}"
+        try:
+            async with _redis.pipeline(transaction=True) as pipe:
+                pipe.hget(key, booking_id)
+                pipe.hdel(key, booking_id)
+                raw, _ = await pipe.execute()
+        except (RedisError, OSError) as e:
+            logger.warning("Booking store error: %s", e)
+            return dict(_STORE_UNAVAILABLE)
+        if not raw:
+            return {"status": "error", "message": f"Booking ID '{booking_id}' not found."}
+        ticket_to_cancel = orjson.loads(raw)
+        return {
+            "status": "success",
+            "message": f"Booking for '{ticket_to_cancel['event_name']}' (ID: {booking_id}) has been canceled."
+        }
     
-    await write_json_file(BOOKINGS_PATH, bookings_db)
+    async with _bookings_lock:
+        bookings_db = await asyncio.to_thread(_load_bookings_sync)
+        user_bookings = bookings_db.get(phone_number, [])
+        
+        ticket_to_cancel = next((b for b in user_bookings if b.get('booking_id') == booking_id), None)
+        
+        if not ticket_to_cancel:
+            return {"status": "error", "message": f"Booking ID '{booking_id}' not found."}
+        
+        op = {"op": "cancel", "phone": phone_number, "booking": ticket_to_cancel}
+        await asyncio.to_thread(_log_booking_op_sync, bookings_db, op)
     
     return {
         "status": "success",
@@ -137,8 +288,16 @@ async def cancel_ticket(booking_id: str, phone_number: str):
 
 async def get_my_tickets(phone_number: str):
     """Get all tickets for a user."""
-    bookings_db = await read_json_file(BOOKINGS_PATH)
-    user_bookings = bookings_db.get(phone_number, [])
+    if _redis:
+        try:
+            raw = await _redis.hvals(f"bookings:{phone_number}")
+        except (RedisError, OSError) as e:
+            logger.warning("Booking store error: %s", e)
+            return dict(_STORE_UNAVAILABLE)
+        user_bookings = sorted((orjson.loads(b) for b in raw), key=lambda b: b.get('booked_at', ''))
+    else:
+        bookings_db = await asyncio.to_thread(_load_bookings_sync)
+        user_bookings = bookings_db.get(phone_number, [])
     
     if not user_bookings:
         return {"status": "not_found", "message": "You have no bookings yet."}